@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Builds dist/sar.pyz, a single-file distribution of the sar CLI for Linux: run it with "python3 sar.pyz bom sar.xls"
+# or directly as "./sar.pyz bom sar.xls". The modules are stored uncompressed and precompiled (zipimport can not
+# write bytecode next to them), so that starting from the archive is as fast as from the source tree.
+# Pure Python dependencies can be bundled too: python linux-zipapp.py --with xlrd --with openpyxl
+# (any pip requirement or wheel file), otherwise they are imported from the Python installation.
+
+import argparse
+import compileall
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipapp
+
+MODULES = ("sar", "sarbatch", "sarbook", "sarcache", "sardaemon", "sarparts", "sarrecords", "sarrollup",
+           "sarrules", "sarstore", "sarsweep", "sartimer", "sarwatch")
+
+MAIN = """import sys
+
+import sar
+
+if __name__ == "__main__":
+    sar.main(sys.argv[1:])
+"""
+
+
+def build(output, requirements=()):
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as staging:
+        for module in MODULES:
+            shutil.copy(os.path.join(source_dir, module + ".py"), staging)
+        with open(os.path.join(staging, "__main__.py"), "w") as f:
+            f.write(MAIN)
+        if requirements:
+            subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "--no-compile", "--target", staging]
+                           + list(requirements), check=True)
+            for path in os.listdir(staging):    # only the packages are needed
+                if path.endswith((".dist-info", ".egg-info")) or path == "bin":
+                    shutil.rmtree(os.path.join(staging, path))
+        # module.pyc next to module.py, the layout zipimport looks for
+        compileall.compile_dir(staging, quiet=1, legacy=True)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        zipapp.create_archive(staging, output, interpreter="/usr/bin/env python3")
+    return output
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='linux-zipapp', usage='%(prog)s [-o dist/sar.pyz] [--with requirement]')
+    parser.add_argument("-o", "--output", action="store", default=os.path.join("dist", "sar.pyz"))
+    parser.add_argument("--with", dest="requirements", action="append", default=[],
+                        help="pure Python dependency to bundle (pip requirement or wheel file), repeatable")
+    args = parser.parse_args(argv)
+    print(build(args.output, args.requirements))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,147 +1,275 @@
 #!/usr/bin/env python3
 
-import xlrd
 import json
 import sys
-import argparse
 import os.path
-import re
 import collections
+import sarbook
+import sarcache
+import sardaemon
+import sarparts
+import sarrecords
+import sarrules
+import sartimer
+
+
+class SARError(Exception):
+    pass
+
+
+SHEET_REVISION = 'Revision History'
+SHEET_CONTACT = 'Contact Information'
+SHEET_CUSTOMERSITE = 'Customer and Site Requirements'
+SHEET_SUBSCRIPTIONS = 'NEW Cloud Subscriptions'
+SHEET_HWREQUIREMENTS = 'NEW Hardware Requirements'
+SHEET_ORDERINFORMATION = 'NEW Order Information'
+
+
+# Location of the data in the SAR file for each SAR release. Releases sharing the same template are listed
+# together, a new SAR release is supported by adding it to an existing entry or by adding a new entry.
+SAR_LAYOUTS = [
+    {
+        "releases": (20180516, 20180515, 20180514, 20180511, 20180701, 20180725),
+        "row": {
+            # Contact sheet
+            "customer name": 6,
+            # Customer and site sheet
+            "country": 29,
+            "indirect sale": 31,
+            # Cloud subscriptions sheet
+            "occ_cp_subscription": 10,  # H11
+            "occ_compute_subscription": 12,  # H13
+            "occ_blockstorage_subscription": 14,  # H15
+            "occ_blockstoragehighio_subscription": 16,  # H17
+            "occ_objectstorage_subscription": 18,  # H19
+            "exacc_base_subscription": 25,  # H26
+            "exacc_quarter_subscription": 27,  # H28
+            "exacc_half_subscription": 29,  # H30
+            "exacc_full_subscription": 31,  # H32
+            "bdcc_starter_subscription": 38,  # H39
+            "bdcc_additional_subscription": 40,  # H41
+            "rack_deployed": 7,  # BL8
+            # Hardware requirements sheet
+            "pdu": 21,
+            "upstream_cable": 21,
+            "rack_connected": 21,
+            "distance": 21,
+            # Order Information
+            "bom": 8,
+        },
+        "col": {
+            # Contact sheet
+            "customer": 5,
+            # Customer and site sheet
+            "install location": 5,
+            # Cloud subscriptions sheet
+            "subscription": 7,  # H
+            "rack_deployed": 63,  # BL8
+            "occ_rack_allocation": 44,  # AS8
+            "exacc_rack_allocation": 56,  # BE8
+            "bdcc_rack_allocation": 60,  # BI8
+            "tor_deployed": 68,  # BQ8
+            "spine_deployed": 69,  # BR8
+            # Hardware requirements sheet
+            "pdu_type": 4,
+            "pdu_whip_count": 10,
+            "rack_connected": 13,
+            "distance": 15,
+            "upstream_cable_type": 16,
+            "upstream_cable_length": 17,
+            "upstream_cable_count": 18,
+            # Order Information
+            "bom": 2,
+        },
+    },
+]
+
+# subscription name in the config -> row in the Cloud subscriptions sheet
+SUBSCRIPTIONS = (
+    ("OCC CP", "occ_cp_subscription"),
+    ("OCC Compute", "occ_compute_subscription"),
+    ("OCC Block storage", "occ_blockstorage_subscription"),
+    ("OCC Block storage High I/O", "occ_blockstoragehighio_subscription"),
+    ("OCC Object storage", "occ_objectstorage_subscription"),
+    ("ExaCC X7 - Base System", "exacc_base_subscription"),
+    ("ExaCC X7 - Quarter System", "exacc_quarter_subscription"),
+    ("ExaCC X7 - Half System", "exacc_half_subscription"),
+    ("ExaCC X7 - Full System", "exacc_full_subscription"),
+    ("BDCC - Starter Pack - 3 Nodes", "bdcc_starter_subscription"),
+    ("BDCC - Additional Nodes", "bdcc_additional_subscription"),
+)
+
+
+def compile_sar_layouts(layouts):
+    # returns {sar release: (row, col)} and {sar release: {subscription name: row}}, built once at import
+    layout_by_release = {}
+    subscription_rows = {}
+    for layout in layouts:
+        rowcol = (dict(layout["row"]), dict(layout["col"]))
+        rows = collections.OrderedDict((name, layout["row"][key]) for name, key in SUBSCRIPTIONS)
+        for release in layout["releases"]:
+            layout_by_release[release] = rowcol
+            subscription_rows[release] = rows
+    return layout_by_release, subscription_rows
+
+
+SAR_LAYOUT_BY_RELEASE, SAR_SUBSCRIPTION_ROWS = compile_sar_layouts(SAR_LAYOUTS)
+
+
+def default_rules_file(partslist_file=None):
+    # the BOM rules file sits next to the parts list
+    return os.path.join(os.path.dirname(partslist_file) if partslist_file else ".", "CatC-bomrules.json")
+
 
 class SARconfig:
-    def __init__(self, sar_file, partslist_file):
+    def __init__(self, sar_file=None, partslist_file=None, parts=None, cache=None, rules_file=None, rules=None, config=None,
+                 timer=None, bom_cache=None):
         self.config = {}    # master config dictionary that contains other dictionaries
-        self.config["customer"] = {}       # sub-dictionary containing customer and site info
+        self.config["customer"] = sarrecords.CustomerInfo()       # customer and site info
         self.config["subscriptions"] = {}  # sub-dictionary containing customer's subscriptions
         self.config["hw"] = collections.OrderedDict()             # sub-dictionary containing hardware config for the different racks
         self.config["network"] = {}        # sub-dictionary containing network configuration
-        self.parts = collections.OrderedDict()     # dictionary with the parts sku and descriptions
+        self.parts = None                          # catalog with the parts sku and descriptions
         self.bom = collections.OrderedDict()       # dictionary for the bill of material for a given config
-        wb = xlrd.open_workbook(sar_file)
-        self.sheet_revision = wb.sheet_by_name('Revision History')
-        self.sheet_contact = wb.sheet_by_name('Contact Information')
-        self.sheet_customersite = wb.sheet_by_name('Customer and Site Requirements')
-        self.sheet_subscriptions = wb.sheet_by_name('NEW Cloud Subscriptions')
-        self.sheet_hwrequirements = wb.sheet_by_name('NEW Hardware Requirements')
-        self.sheet_orderinformation = wb.sheet_by_name('NEW Order Information')
-        self.config["sar release"] = int(self.sheet_revision.cell_value(0, 20))  # Revision History sheet, cell U1
-        self.parts = self.load_parts(partslist_file)   # populate the dictionary of parts
-        self.load_customer_info()      # populate the dictionary of customer and site info
-        self.load_subscription_info()  # populate the dictionary of customer's subscriptions
-        self.load_rack_info()          # populate the dictionary of hardware config for the different racks
-        self.bom = self.build_bom()    # populate the dictionary for the bill of material
+        self.order_information = None      # BOM text of each rack as found in the Order Information sheet
+        self.cache_hit = False
+        self.workbook = None
+        self.sheets = {}    # sheets currently loaded from the workbook, by name
+        self.timer = timer or sartimer.NULL_TIMER   # records the time spent in each stage
+        self.bom_cache = bom_cache          # rack BOMs already built with the same parts list and rules, by rack_bom_key
+        self.rack_bom_keys = collections.OrderedDict()    # key of each rack in bom_cache
+        self.racks_built = 0                # racks whose BOM was not found in bom_cache
+        if config is not None:             # config already extracted (e.g. generated or edited), no SAR file to read
+            self.config = config
+        else:
+            self.load_sar_file(sar_file, cache)
+        with self.timer.stage("load_parts"):
+            self.parts = parts if parts is not None else self.load_parts(partslist_file)   # populate the dictionary of parts
+            self.parts_position = {partname: position for position, partname in enumerate(self.parts)}
+        with self.timer.stage("load_rules"):
+            self.rules = rules if rules is not None else self.load_rules(rules_file or default_rules_file(partslist_file))
+        with self.timer.stage("build_bom"):
+            self.bom = self.build_bom()    # populate the dictionary for the bill of material
 
-    def locate_data_in_sar_file(self):
-        row = {}
-        col = {}
-        if self.config["sar release"] in (20180516, 20180515, 20180514, 20180511, 20180701, 20180725):
-            # Contact sheet
-            col["customer"] = 5
-            row["customer name"] = 6
-            # Customer and site sheet
-            col["install location"] = 5
-            row["country"] = 29
-            row["indirect sale"] = 31
-            # Cloud subscriptions sheet
-            col["subscription"] = 7 # H
-            row["occ_cp_subscription"] = 10  # H11
-            row["occ_compute_subscription"] = 12  # H13
-            row["occ_blockstorage_subscription"] = 14  # H15
-            row["occ_blockstoragehighio_subscription"] = 16  # H17
-            row["occ_objectstorage_subscription"] = 18  # H19
-            row["exacc_base_subscription"] = 25  # H26
-            row["exacc_quarter_subscription"] = 27  # H28
-            row["exacc_half_subscription"] = 29  # H30
-            row["exacc_full_subscription"] = 31  # H32
-            row["bdcc_starter_subscription"] = 38  # H39
-            row["bdcc_additional_subscription"] = 40  # H41
-            col["rack_deployed"] = 63  # BL8
-            row["rack_deployed"] = 7  # BL8
-            col["occ_rack_allocation"] = 44  # AS8
-            col["exacc_rack_allocation"] = 56  # BE8
-            col["bdcc_rack_allocation"] = 60  # BI8
-            col["tor_deployed"] = 68  # BQ8
-            col["spine_deployed"] = 69  # BR8
-            # Hardware requirements sheet
-            row["pdu"] = 21
-            col["pdu_type"] = 4
-            col["pdu_whip_count"] = 10
-            row["upstream_cable"] = 21
-            col["upstream_cable_type"] = 16
-            col["upstream_cable_length"] = 17
-            col["upstream_cable_count"] = 18
-            row["rack_connected"] = 21
-            col["rack_connected"] = 13
-            col["distance"] = 15
-            row["distance"] = 21
-            # Order Information
-            row["bom"] = 8
-            col["bom"] = 2
+    def load_sar_file(self, sar_file, cache=None):
+        with self.timer.stage("cache"):
+            sar_hash = sarcache.file_hash(sar_file) if cache is not None else None
+            entry = cache.get(sar_hash) if cache is not None else None
+        if entry is not None:              # parsed data found in the cache, no need to open the workbook
+            self.config = sarrecords.typed_config(entry["config"])
+            self.order_information = entry["order information"]
+            self.cache_hit = True
         else:
-            sys.exit("Unsupported SAR release")
-        return (row,col)
+            with self.timer.stage("open_workbook"):
+                self.workbook = self.open_workbook(sar_file)
+                self.config["sar release"] = int(self.sheet_revision.cell_value(0, 20))  # Revision History sheet, cell U1
+                self.release_sheet(SHEET_REVISION)
+            with self.timer.stage("load_customer_info"):
+                self.load_customer_info()      # populate the dictionary of customer and site info
+            with self.timer.stage("load_subscription_info"):
+                self.load_subscription_info()  # populate the dictionary of customer's subscriptions
+            with self.timer.stage("load_rack_info"):
+                self.load_rack_info()          # populate the dictionary of hardware config for the different racks
+            if cache is not None:
+                with self.timer.stage("cache"):
+                    cache.put(sar_hash, {"config": self.config, "order information": self.load_order_information()})
+            # without the cache the workbook stays open until diff_bom needs the Order Information sheet
+
+    def open_workbook(self, sar_file):
+        # xlrd for .xls files, streaming openpyxl reader for .xlsx files (see sarbook)
+        try:
+            return sarbook.open_workbook(sar_file)
+        except ImportError as e:
+            raise SARError(str(e))
+
+    def sheet(self, name):
+        if self.workbook is None:
+            raise SARError("No SAR file loaded, or SAR file already closed")
+        if name not in self.sheets:
+            self.sheets[name] = self.workbook.sheet_by_name(name)
+        return self.sheets[name]
+
+    def release_sheet(self, name):
+        if self.sheets.pop(name, None) is not None:
+            self.workbook.unload_sheet(name)
+
+    def close(self):
+        if self.workbook is not None:
+            self.sheets = {}
+            self.workbook.release_resources()
+            self.workbook = None
+
+    @property
+    def sheet_revision(self):
+        return self.sheet(SHEET_REVISION)
+
+    @property
+    def sheet_contact(self):
+        return self.sheet(SHEET_CONTACT)
+
+    @property
+    def sheet_customersite(self):
+        return self.sheet(SHEET_CUSTOMERSITE)
+
+    @property
+    def sheet_subscriptions(self):
+        return self.sheet(SHEET_SUBSCRIPTIONS)
+
+    @property
+    def sheet_hwrequirements(self):
+        return self.sheet(SHEET_HWREQUIREMENTS)
+
+    @property
+    def sheet_orderinformation(self):
+        return self.sheet(SHEET_ORDERINFORMATION)
+
+    def locate_data_in_sar_file(self):
+        try:
+            return SAR_LAYOUT_BY_RELEASE[self.config["sar release"]]
+        except KeyError:
+            raise SARError("Unsupported SAR release: " + str(self.config["sar release"]))
 
     def load_customer_info(self):
         (row, col) = self.locate_data_in_sar_file()
-        self.config["customer"]["name"] = self.sheet_contact.cell(row["customer name"], col["customer"]).value
-        country = self.sheet_customersite.cell(row["country"], col["install location"]).value
+        self.config["customer"]["name"] = self.sheet_contact.cell_value(row["customer name"], col["customer"])
+        customersite = self.sheet_customersite
+        country = customersite.cell_value(row["country"], col["install location"])
         if country[-4:] == "(**)":
             self.config["customer"]["country"] = country[:-4]
-            if self.sheet_customersite.cell(row["indirect sale"], col["install location"]).value == "Yes":
+            if customersite.cell_value(row["indirect sale"], col["install location"]) == "Yes":
                 self.config["customer"]["indirect"] = True
             else:
                 self.config["customer"]["indirect"] = False
         else:
             self.config["customer"]["country"] = country
             self.config["customer"]["indirect"] = False
+        self.release_sheet(SHEET_CONTACT)
+        self.release_sheet(SHEET_CUSTOMERSITE)
 
     def load_subscription_info(self):
         (row, col) = self.locate_data_in_sar_file()
-        self.config["subscriptions"]["OCC CP"] = int(
-            self.sheet_subscriptions.cell(row["occ_cp_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["occ_cp_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["OCC Compute"] = int(
-            self.sheet_subscriptions.cell(row["occ_compute_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["occ_compute_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["OCC Block storage"] = int(
-            self.sheet_subscriptions.cell(row["occ_blockstorage_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["occ_blockstorage_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["OCC Block storage High I/O"] = int(
-            self.sheet_subscriptions.cell(row["occ_blockstoragehighio_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["occ_blockstoragehighio_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["OCC Object storage"] = int(
-            self.sheet_subscriptions.cell(row["occ_objectstorage_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["occ_objectstorage_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["ExaCC X7 - Base System"] = int(
-            self.sheet_subscriptions.cell(row["exacc_base_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["exacc_base_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["ExaCC X7 - Quarter System"] = int(
-            self.sheet_subscriptions.cell(row["exacc_quarter_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["exacc_quarter_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["ExaCC X7 - Half System"] = int(
-            self.sheet_subscriptions.cell(row["exacc_half_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["exacc_half_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["ExaCC X7 - Full System"] = int(
-            self.sheet_subscriptions.cell(row["exacc_full_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["exacc_full_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["BDCC - Starter Pack - 3 Nodes"] = int(
-            self.sheet_subscriptions.cell(row["bdcc_starter_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["bdcc_starter_subscription"], col["subscription"]).value != '' else 0
-        self.config["subscriptions"]["BDCC - Additional Nodes"] = int(
-            self.sheet_subscriptions.cell(row["bdcc_additional_subscription"], col["subscription"]).value) \
-                if self.sheet_subscriptions.cell(row["bdcc_additional_subscription"], col["subscription"]).value != '' else 0
-
-    def load_parts(self, partslist_file):
-        with open(partslist_file) as f:
-            parts = json.load(f, object_pairs_hook=collections.OrderedDict)
-        return parts
+        subscription_rows = SAR_SUBSCRIPTION_ROWS[self.config["sar release"]]
+        first_rowx = min(subscription_rows.values())
+        end_rowx = max(subscription_rows.values()) + 1
+        values = self.sheet_subscriptions.col_values(col["subscription"], first_rowx, end_rowx)   # whole subscription column at once
+        for name, rowx in subscription_rows.items():
+            value = values[rowx - first_rowx]
+            self.config["subscriptions"][name] = int(value) if value != '' else 0
+
+    @staticmethod
+    def load_rules(rules_file):
+        return sarrules.load_rules(rules_file)     # compiled once per process
+
+    @staticmethod
+    def load_parts(partslist_file):
+        return sarparts.load_catalog(partslist_file)    # compiled snapshot of the parts list, rebuilt when the file changes
 
     def get_rack_count(self, row, col):
-        rack_deployed = self.sheet_subscriptions.col_slice(colx=col["rack_deployed"], start_rowx=row["rack_deployed"],
-                                                     end_rowx=row["rack_deployed"] + 11)
+        rack_deployed = self.sheet_subscriptions.col_values(col["rack_deployed"], start_rowx=row["rack_deployed"],
+                                                            end_rowx=row["rack_deployed"] + 11)
         rackcount = 0
-        for cell in rack_deployed:
-            if int(cell.value) != 0:
+        for value in rack_deployed:
+            if int(value) != 0:
                 rackcount = rackcount + 1
             else:
                 break
@@ -149,314 +277,557 @@ class SARconfig:
 
     def load_rack_info(self):
         (row, col) = self.locate_data_in_sar_file()
+        hwsheet = self.sheet_hwrequirements
         rackcount = self.get_rack_count(row, col)
+        # Hardware requirements rows of all the racks (plus the one after, see rack1 distance), read in one go
+        hw_rowkeys = ("pdu", "upstream_cable", "rack_connected", "distance")
+        hw_first_rowx = min(row[k] for k in hw_rowkeys)
+        hw_end_rowx = min(max(row[k] for k in hw_rowkeys) + rackcount + 1, hwsheet.nrows)
+        hwrows = [hwsheet.row_values(rowx) for rowx in range(hw_first_rowx, hw_end_rowx)]
+        occ = col["occ_rack_allocation"]
+        exacc = col["exacc_rack_allocation"]
+        bdcc = col["bdcc_rack_allocation"]
         for rackid in range(rackcount):
             rackname = "rack" + str(rackid + 1)
-            self.config["hw"][rackname] = {}
-            self.config["hw"][rackname]["id"] = rackid + 1
-            if self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"]).value > 0:
-                if self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 1).value == 1:
-                    self.config["hw"][rackname]["type"] = "OCC CP"
-                    self.config["hw"][rackname]["CP qty"] = int(
-                        self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 1).value)
+            sub = self.sheet_subscriptions.row_values(row["rack_deployed"] + rackid)   # whole rack row at once
+            pdu = hwrows[row["pdu"] - hw_first_rowx + rackid]
+            upstream = hwrows[row["upstream_cable"] - hw_first_rowx + rackid]
+            rack = self.config["hw"][rackname] = sarrecords.RackConfig()
+            rack["id"] = rackid + 1
+            if sub[occ] > 0:
+                if sub[occ + 1] == 1:
+                    rack["type"] = "OCC CP"
+                    rack["CP qty"] = int(sub[occ + 1])
                 else:
-                    self.config["hw"][rackname]["type"] = "OCC"
-                self.config["hw"][rackname]["block hdd qty"] = int(
-                    self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 2).value)
-                self.config["hw"][rackname]["object qty"] = int(
-                    self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 3).value)
-                self.config["hw"][rackname]["oasg qty"] = int(
-                    self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 4).value)
-                self.config["hw"][rackname]["block ssd qty"] = int(
-                    self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 6).value)
-                self.config["hw"][rackname]["compute qty"] = int(
-                    self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["occ_rack_allocation"] + 7).value)
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["exacc_rack_allocation"]).value > 0:
-                self.config["hw"][rackname]["type"] = "ExaCC Full"
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["exacc_rack_allocation"] + 1).value > 0:
-                self.config["hw"][rackname]["type"] = "ExaCC Half"
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["exacc_rack_allocation"] + 2).value > 0:
-                self.config["hw"][rackname]["type"] = "ExaCC Quarter"
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["exacc_rack_allocation"] + 3).value > 0:
-                self.config["hw"][rackname]["type"] = "ExaCC Base"
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["bdcc_rack_allocation"]).value > 0:
-                self.config["hw"][rackname]["type"] = "BDCC Full"
-                self.config["hw"][rackname]["node qty"] = int(self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["bdcc_rack_allocation"] + 2).value)
-            elif self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["bdcc_rack_allocation"] + 1).value > 0:
-                self.config["hw"][rackname]["type"] = "BDCC Starter"
-                self.config["hw"][rackname]["node qty"] = int(self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["bdcc_rack_allocation"] + 2).value)
-            self.config["hw"][rackname]["ToR deployed"] = True \
-                if self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["tor_deployed"]).value == 'Y' else False
-            self.config["hw"][rackname]["spine deployed"] = True \
-                if self.sheet_subscriptions.cell(row["rack_deployed"] + rackid, col["spine_deployed"]).value == 'Y' else False
-            self.config["hw"][rackname]["pdu type"] = self.sheet_hwrequirements.cell(row["pdu"] + rackid, col["pdu_type"]).value
-            self.config["hw"][rackname]["internal connection"] = {}
-            if self.config["hw"][rackname]["ToR deployed"] or self.config["hw"][rackname]["type"] in ("BDCC Full", "BDCC Starter", "BDCC Addn"):
-                self.config["hw"][rackname]["upstream cable type"] = self.sheet_hwrequirements.cell(row["upstream_cable"] + rackid, col["upstream_cable_type"]).value
-                self.config["hw"][rackname]["upstream cable length"] = self.sheet_hwrequirements.cell(row["upstream_cable"] + rackid, col["upstream_cable_length"]).value
-                self.config["hw"][rackname]["upstream cable count"] = int(self.sheet_hwrequirements.cell(row["upstream_cable"] + rackid, col["upstream_cable_count"]).value) \
-                    if self.sheet_hwrequirements.cell(row["upstream_cable"] + rackid, col["upstream_cable_count"]).value != "" else 0
+                    rack["type"] = "OCC"
+                rack["block hdd qty"] = int(sub[occ + 2])
+                rack["object qty"] = int(sub[occ + 3])
+                rack["oasg qty"] = int(sub[occ + 4])
+                rack["block ssd qty"] = int(sub[occ + 6])
+                rack["compute qty"] = int(sub[occ + 7])
+            elif sub[exacc] > 0:
+                rack["type"] = "ExaCC Full"
+            elif sub[exacc + 1] > 0:
+                rack["type"] = "ExaCC Half"
+            elif sub[exacc + 2] > 0:
+                rack["type"] = "ExaCC Quarter"
+            elif sub[exacc + 3] > 0:
+                rack["type"] = "ExaCC Base"
+            elif sub[bdcc] > 0:
+                rack["type"] = "BDCC Full"
+                rack["node qty"] = int(sub[bdcc + 2])
+            elif sub[bdcc + 1] > 0:
+                rack["type"] = "BDCC Starter"
+                rack["node qty"] = int(sub[bdcc + 2])
+            rack["ToR deployed"] = True if sub[col["tor_deployed"]] == 'Y' else False
+            rack["spine deployed"] = True if sub[col["spine_deployed"]] == 'Y' else False
+            rack["pdu type"] = pdu[col["pdu_type"]]
+            rack["internal connection"] = sarrecords.InternalConnection()
+            if rack["ToR deployed"] or rack["type"] in ("BDCC Full", "BDCC Starter", "BDCC Addn"):
+                rack["upstream cable type"] = upstream[col["upstream_cable_type"]]
+                rack["upstream cable length"] = upstream[col["upstream_cable_length"]]
+                rack["upstream cable count"] = int(upstream[col["upstream_cable_count"]]) \
+                    if upstream[col["upstream_cable_count"]] != "" else 0
                 if self.config["hw"]["rack1"]["spine deployed"]:
-                    self.config["hw"][rackname]["internal connection"]["type"] = "ToR to spine"
+                    rack["internal connection"]["type"] = "ToR to spine"
                     if rackid == 0:
-                        self.config["hw"][rackname]["internal connection"]["distance"] = self.sheet_hwrequirements.cell(
-                            row["distance"] + rackid + 1, col["distance"]).value  # distance for Rack2 instead
+                        rack["internal connection"]["distance"] = \
+                            hwrows[row["distance"] - hw_first_rowx + rackid + 1][col["distance"]]  # distance for Rack2 instead
                     else:
-                        self.config["hw"][rackname]["internal connection"]["distance"] = self.sheet_hwrequirements.cell(
-                            row["distance"] + rackid, col["distance"]).value
-                        self.config["hw"][rackname]["internal connection"]["distance to OOB"] = \
-                            self.config["hw"][rackname]["internal connection"]["distance"]
+                        rack["internal connection"]["distance"] = hwrows[row["distance"] - hw_first_rowx + rackid][col["distance"]]
+                        rack["internal connection"]["distance to OOB"] = rack["internal connection"]["distance"]
                 else:
                     if rackid > 0:
-                        self.config["hw"][rackname]["internal connection"]["type"] = "ToR to ToR"
-                        self.config["hw"][rackname]["internal connection"]["distance"] = self.sheet_hwrequirements.cell(
-                            row["distance"] + rackid, col["distance"]).value
-                        self.config["hw"][rackname]["internal connection"]["distance to OOB"] = \
-                            self.config["hw"][rackname]["internal connection"]["distance"]
+                        rack["internal connection"]["type"] = "ToR to ToR"
+                        rack["internal connection"]["distance"] = hwrows[row["distance"] - hw_first_rowx + rackid][col["distance"]]
+                        rack["internal connection"]["distance to OOB"] = rack["internal connection"]["distance"]
             else:
-                self.config["hw"][rackname]["internal connection"]["type"] = "eth to ToR"
-                self.config["hw"][rackname]["internal connection"]["to rack"] = self.sheet_hwrequirements.cell(
-                    row["rack_connected"] + rackid, col["rack_connected"]).value
-                self.config["hw"][rackname]["internal connection"]["distance"] = self.sheet_hwrequirements.cell(
-                    row["distance"] + rackid, col["distance"]).value
-                self.config["hw"][rackname]["internal connection"]["distance to OOB"] = self.config["hw"][rackname]["internal connection"]["distance"]   # gap: not captured in SAR
-
-    def init_rack_partsqty(self):
-        rackpartsqty = collections.OrderedDict()
-        for partname, info in self.parts.items():
-            rackpartsqty[partname] = 0
-        return rackpartsqty
+                rack["internal connection"]["type"] = "eth to ToR"
+                rack["internal connection"]["to rack"] = hwrows[row["rack_connected"] - hw_first_rowx + rackid][col["rack_connected"]]
+                rack["internal connection"]["distance"] = hwrows[row["distance"] - hw_first_rowx + rackid][col["distance"]]
+                rack["internal connection"]["distance to OOB"] = rack["internal connection"]["distance"]   # gap: not captured in SAR
+        self.release_sheet(SHEET_SUBSCRIPTIONS)
+        self.release_sheet(SHEET_HWREQUIREMENTS)
+
+    def sort_rack_partsqty(self, rackpartsqty):
+        # sparse BOM of a rack: only the parts with a quantity, in parts list order
+        # (parts missing from the parts list come last, in the order they were added)
+        position = self.parts_position
+        return collections.OrderedDict(sorted(((partname, qty) for partname, qty in rackpartsqty.items() if qty > 0),
+                                              key=lambda item: position.get(item[0], len(position))))
 
     def build_bom(self):
         partsqty = collections.OrderedDict()   # dictionary of racks associated with a sub-dictionary of parts/qty to include in the BOM
         for rackname, rackconfig in self.config["hw"].items():
-            partsqty[rackname] = self.init_rack_partsqty()   # sub-dictionary of parts/qty to include in the BOM
-            # adding parts for eack type of rack
-            if rackconfig["type"] in ("OCC CP", "OCC"):     # adding OCC parts
-                partsqty[rackname]["OCC"] = 1
-                if self.config["customer"]["indirect"]:
-                    partsqty[rackname]["OCC rack resale"] = 1
-                else:
-                    partsqty[rackname]["OCC rack"] = 1
-                if rackconfig["type"] == "OCC CP":      # adding OCC Control Plane parts
-                    if rackconfig["CP qty"] == 1:       # OCC CP contains 5 admin nodes, 2 regular compute and 1 block SSD
-                        partsqty[rackname]["OCC admin"] += 5
-                        partsqty[rackname]["OCC compute"] += 2
-                        partsqty[rackname]["OCC block ssd"] += 1
-                partsqty[rackname]["OCC compute"] += rackconfig["compute qty"]
-                partsqty[rackname]["OCC block ssd"] += rackconfig["block ssd qty"]
-                partsqty[rackname]["OCC block hdd"] += rackconfig["block hdd qty"]
-                partsqty[rackname]["OCC object"] += rackconfig["object qty"]
-                partsqty[rackname]["OCC software"] += 1
-                partsqty[rackname]["Juniper support ToR"] += 1
-                partsqty[rackname]["Juniper support Spine"] += 1
-                partsqty[rackname]["install service Engineered Systems"] += 1
-                partsqty[rackname]["Cisco support"] += 1
-                partsqty[rackname]["OASG"] += rackconfig["oasg qty"]
-                if partsqty[rackname]["OASG"] > 0:    # OASG requires 2 power cables
-                    partsqty[rackname]["power cable"] += 2
-                partsqty[rackname]["install service OASG"] += rackconfig["oasg qty"]   # install service to include with OASG
-            elif rackconfig["type"] in ("ExaCC Base", "ExaCC Quarter", "ExaCC Half", "ExaCC Full"):   # adding ExaCC parts
-                if rackconfig["type"] == "ExaCC Base":
-                    partsqty[rackname]["ExaCC"] = 1
-                elif rackconfig["type"] == "ExaCC Quarter":
-                    partsqty[rackname]["ExaCC"] = 1
-                elif rackconfig["type"] == "ExaCC Half":
-                    partsqty[rackname]["ExaCC"] = 1
-                elif rackconfig["type"] == "ExaCC Full":
-                    partsqty[rackname]["ExaCC"] = 1
-                if rackconfig["ToR deployed"]:
-                    partsqty[rackname]["ExaCC ToR"] = 2
-                    partsqty[rackname]["ExaCC cable kit"] = 1
-            elif rackconfig["type"] in ("BDCC Full", "BDCC Starter"):               # adding BDCC parts
-                partsqty[rackname]["BDCC"] = 1
-                partsqty[rackname]["BDCC base rack"] = 1
-                if rackconfig["type"] == "BDCC Starter":
-                    partsqty[rackname]["BDCC starter rack"] = 1
-                elif rackconfig["type"] == "BDCC Full":
-                    partsqty[rackname]["BDCC full rack"] = 1
-                partsqty[rackname]["BDCC node"] = rackconfig["node qty"]
-            # adding North-South cables and transceivers
-            if rackconfig["ToR deployed"]:           # we provide upstream cables and transceivers for ToR switches
-                cablename = "cable " + rackconfig["upstream cable type"] + " " + rackconfig["upstream cable length"]
-                partsqty[rackname][cablename] = rackconfig["upstream cable count"]
-                if rackconfig["upstream cable type"] == "MPO_4LC":
-                    partsqty[rackname]["TRX QSFP+ ESR4"] = rackconfig["upstream cable count"]      # MPO-4LC cables require ESR4 transceivers
-                else:
-                    partsqty[rackname]["TRX QSFP+ SR4"] = rackconfig["upstream cable count"]      # MPO-MPO cables require SR4 transceivers
-            elif rackconfig["type"] in ("BDCC Full", "BDCC Starter"):      # for BDCC, the transceivers are already included as part of the NM2 GW so we just provide upstream cables
-                cablename = "cable " + rackconfig["upstream cable type"] + " " + rackconfig["upstream cable length"]
-                partsqty[rackname][cablename] = rackconfig["upstream cable count"]
-            # adding East-West cables and transceivers
-            if rackname == "rack1":
-                if rackconfig["spine deployed"]:   # rack1 with a spine includes 4 short MPO_MPO cables to connect to spine, 2 go in rack1, 2 go in rack2
-                    partsqty[rackname]["spine"] = 1
-                    partsqty[rackname]["cable MPO_MPO 5m"] += 4
-                    partsqty[rackname]["TRX QSFP+ SR4"] += 8
-            elif rackconfig["ToR deployed"]:   # rack2 with a spine requires 4 MPO_MPO cables to connect to spine, 2 go in rack1, 2 go in rack2
-                                               # other racks with ToR require 4 MPO_MPO cables to connect to spine
-                cablename = "cable MPO_MPO " + rackconfig["internal connection"]["distance"]
-                partsqty[rackname][cablename] += 4
-                partsqty[rackname]["TRX QSFP+ SR4"] += 8
-            elif rackconfig["type"] in ("BDCC Full", "BDCC Starter", "BDCC Addn"):
-                cablename = "cable MPO_MPO " + rackconfig["internal connection"]["distance"]
-                partsqty[rackname][cablename] += 2
-                partsqty[rackname]["TRX QSFP+ SR4"] += 2
-            elif not rackconfig["ToR deployed"]:  # ExaCC without ToR connect to a ExaCC rack using LC cables or to a OCC rack using copper cables
-                connected_rack = rackconfig["internal connection"]["to rack"]
-                if self.config["hw"][connected_rack]["type"] in ("ExaCC Base", "ExaCC Quarter", "ExaCC Half", "ExaCC Full"):
-                    cablename = "cable LC " + rackconfig["internal connection"]["distance"]
-                    partsqty[rackname][cablename] += 10
-                    partsqty[rackname]["TRX SFP+"] += 8
-                elif self.config["hw"][connected_rack]["type"] in ("OCC CP", "OCC"):
-                    cablename = "cable CAT6 " + rackconfig["internal connection"]["distance"]
-                    partsqty[rackname][cablename] += 9
-            # adding copper cables for OOB switch connections
-            if rackconfig["type"] == "OCC CP":
-                partsqty[rackname]["cable CAT6 5m"] += 1     # cable to connect the OASG to the OOB switch both located in the same rack
-            else:
-                if rackconfig["internal connection"] != {}:   # exclude case of ExaCC scenario7 where ExaCC rack has no attachment to OCC CP
-                    cablename = "cable CAT6 " + rackconfig["internal connection"]["distance"]   # cable to connect the rack OOB switch to the rack1 OOB switch
-                    partsqty[rackname][cablename] += 1
-            # PDU
-            if rackconfig["pdu type"] == "* Single-Phase 2(Two)x22kVA High Voltage Power Supplies (EMEA & APAC (excluding Japan /Taiwan)":
-                partsqty[rackname]["PDU 1phase-230V-22kVA"] += 1
-            elif rackconfig["pdu type"] == "* Single-Phase 2(Two)x15kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-120V-15kVA"] += 1
-            elif rackconfig["pdu type"] == "* Single-Phase 2(Two)x22kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-120V-22kVA"] += 1
-            elif rackconfig["pdu type"] == "* Three-Phase 2(Two)x15kVA High Voltage Power Supplies  (EMEA & APAC (excluding Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-230V-15kVA"] += 1
-            elif rackconfig["pdu type"] == "* Three-Phase 2(Two)x24kVA High Voltage Power Supplies  (EMEA & APAC (excluding Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-230V-24kVA"] += 1
-            elif rackconfig["pdu type"] == "* Three-Phase 2(Two)x15kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-120V-15kVA"] += 1
-            elif rackconfig["pdu type"] == "* Three-Phase 2(Two)x24kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)":
-                partsqty[rackname]["PDU 3phase-120V-24kVA"] += 1
+            # parts for the rack type, North-South and East-West cables and transceivers, OOB cables and PDU,
+            # as described in the BOM rules file
+            if self.bom_cache is None:
+                partsqty[rackname] = self.sort_rack_partsqty(self.rules.evaluate(rackconfig, rackname, self.config))
+                continue
+            key = self.rack_bom_key(rackname)
+            if key not in self.bom_cache:
+                self.bom_cache[key] = self.sort_rack_partsqty(self.rules.evaluate(rackconfig, rackname, self.config))
+                self.racks_built += 1
+            self.rack_bom_keys[rackname] = key
+            partsqty[rackname] = self.bom_cache[key]
         return partsqty
 
-    def dump_bom(self):
-        return json.dumps(self.bom, indent=4)
+    def rack_bom_key(self, rackname):
+        # everything the BOM rules can look at for a rack: its name and config, the customer info and the config
+        # of the rack it is connected to
+        rackconfig = self.config["hw"][rackname]
+        connected = self.config["hw"].get(rackconfig.get("internal connection", {}).get("to rack"))
+        return json.dumps([rackname, rackconfig, self.config["customer"], connected], default=sarrecords.to_json)
 
-    def print_bom(self):
+    def dump_bom(self, compact=False):
+        if compact:     # only the parts included in the BOM
+            return json.dumps(self.bom, indent=4)
+        bom = collections.OrderedDict()
+        for rack, partslist in self.bom.items():
+            bom[rack] = collections.OrderedDict((partname, partslist.get(partname, 0)) for partname in self.parts)
+            bom[rack].update(partslist)     # parts missing from the parts list, if any
+        return json.dumps(bom, indent=4)
+
+    def render_bom(self):
+        # BOM as text, built in memory and written at once by print_bom (one print per line is slow on large orders)
+        lines = []
         for rack, partslist in self.bom.items():
-            print(rack)
+            lines.append(rack)
             for partnickname, qty in partslist.items():
                 if qty > 0:
                     if self.config["hw"][rack]["type"] == "OCC CP" and partnickname == "OCC":
-                        print("## ORACLE CLOUD AT CUSTOMER X6 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"], self.parts[partnickname]["label"]))
-                        print("Type   :New System")
+                        lines.append("## ORACLE CLOUD AT CUSTOMER X6 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku, self.parts[partnickname].label))
+                        lines.append("Type   :New System")
                     elif self.config["hw"][rack]["type"] == "OCC" and partnickname == "OCC":
-                        print("## ORACLE CLOUD AT CUSTOMER X6 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-                        print("Type   :Expansion")
+                        lines.append("## ORACLE CLOUD AT CUSTOMER X6 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+                        lines.append("Type   :Expansion")
                     elif self.config["hw"][rack]["type"] == "ExaCC Base" and partnickname == "ExaCC":
-                        print("## EXADATA CLOUD AT CUSTOMER X7 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-                        print("Rack Size : Base Rack")
+                        lines.append("## EXADATA CLOUD AT CUSTOMER X7 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+                        lines.append("Rack Size : Base Rack")
                     elif self.config["hw"][rack]["type"] == "ExaCC Quarter" and partnickname == "ExaCC":
-                        print("## EXADATA CLOUD AT CUSTOMER X7 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-                        print("Rack Size : Quarter Rack")
+                        lines.append("## EXADATA CLOUD AT CUSTOMER X7 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+                        lines.append("Rack Size : Quarter Rack")
                     elif self.config["hw"][rack]["type"] == "ExaCC Half" and partnickname == "ExaCC":
-                        print("## EXADATA CLOUD AT CUSTOMER X7 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-                        print("Rack Size : Half Rack")
+                        lines.append("## EXADATA CLOUD AT CUSTOMER X7 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+                        lines.append("Rack Size : Half Rack")
                     elif self.config["hw"][rack]["type"] == "ExaCC Full" and partnickname == "ExaCC":
-                        print("## EXADATA CLOUD AT CUSTOMER X7 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-                        print("Rack Size : Full Rack")
+                        lines.append("## EXADATA CLOUD AT CUSTOMER X7 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+                        lines.append("Rack Size : Full Rack")
                     elif partnickname == "BDCC":
-                        print("## BIG DATA CLOUD AT CUSTOMER X7 ##")
-                        print("Qty    Part  # Description")
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
+                        lines.append("## BIG DATA CLOUD AT CUSTOMER X7 ##")
+                        lines.append("Qty    Part  # Description")
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
                     else:
-                        print('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname]["sku"],
-                                                         self.parts[partnickname]["label"]))
-            print()
+                        lines.append('{0:3} x  {1:7}  {2}'.format(str(qty), self.parts[partnickname].sku,
+                                                                self.parts[partnickname].label))
+            lines.append("")
+        return "".join(line + "\n" for line in lines)
+
+    def print_bom(self):
+        sys.stdout.write(self.render_bom())
 
     def dump_config(self):
-        return json.dumps(self.config, indent=4)
+        return json.dumps(self.config, indent=4, default=sarrecords.to_json)
+
+    def dump_all(self, near=False):
+        # config, BOM and diff of the SAR in one JSON document
+        result = collections.OrderedDict()
+        result["config"] = self.config
+        result["bom"] = self.bom
+        result["diff"] = self.diff_bom(near=near)
+        return json.dumps(result, indent=4, default=sarrecords.to_json)
 
     def dump_partslist(self):
-        return json.dumps(self.parts, indent=4)
+        return json.dumps(self.parts.to_dict(), indent=4)
 
-    def diff_bom(self):
-        (row, col) = self.locate_data_in_sar_file()
-        sarfilebom = {}
-        rackid = 0
-        for rack, partslist in self.bom.items():
-            bom_fromxls = []
+    def load_order_information(self):
+        if self.order_information is None:
+            (row, col) = self.locate_data_in_sar_file()
+            rackcount = len(self.config["hw"])
+            sheet = self.sheet_orderinformation
+            self.order_information = sheet.col_values(col["bom"], row["bom"], min(row["bom"] + rackcount, sheet.nrows))
+            self.order_information += [""] * (rackcount - len(self.order_information))   # no BOM entered for these racks
+            self.close()    # last sheet needed from the workbook
+        return self.order_information
+
+    def diff_bom(self, near=False):
+        # compares the BOM of each rack found in the Order Information sheet with the generated one,
+        # see diff_bom_lines for the structure of the result
+        sarfilebom = self.load_order_information()
+        diff = collections.OrderedDict()
+        for rackid, (rack, partslist) in enumerate(self.bom.items()):
+            (bom_fromxls, ignored) = parse_bom_text(sarfilebom[rackid])
             bom_generated = []
-            print(rack + ":")
-            sarfilebom[rack] = self.sheet_orderinformation.cell(row["bom"] + rackid, col["bom"]).value
-            rack_bom_lines = [y for y in (x.strip() for x in sarfilebom[rack].splitlines()) if y]
-            for line in rack_bom_lines:
-                m = re.match(r"^(\d+)\s* x \s*(.*?) \s*(.*)$", line)
-                if m:
-                    if m.group(3)[:2] == "* ":
-                        bom_fromxls.append((int(m.group(1)), m.group(2), m.group(3)[2:]))
-                    else:
-                        bom_fromxls.append((int(m.group(1)), m.group(2), m.group(3)))
-                else:
-                    print("Ignored line: " + line)
             for partnickname, qty in partslist.items():
                 if qty > 0:
-                    sku = self.parts[partnickname]["sku"]
-                    label = self.parts[partnickname]["label"]
-                    bom_generated.append((qty, sku, label))
-            #print(bom_fromxls)
-            #print(bom_generated)
-            for line in bom_fromxls:
-                if line in bom_generated:
-                    bom_generated.remove(line)
-                else:
-                    print('in XLS but not generated:    {0:3} x  {1:7}  {2}'.format(str(line[0]), line[1], line[2]))
-            for line in bom_generated:
-                print('generated but not in XLS:    {0:3} x  {1:7}  {2}'.format(str(line[0]), line[1], line[2]))
-            print()
-            rackid += 1
+                    sku, label = self.parts[partnickname]
+                    bom_generated.append(sarrecords.BomLine(qty, sku, label))
+            diff[rack] = diff_bom_lines(bom_fromxls, bom_generated, near)
+            diff[rack]["ignored lines"] = ignored
+            diff[rack].move_to_end("ignored lines", last=False)
+        return diff
+
+    def print_diff(self, diff):
+        print(render_diff(diff), end="")
+
+    def dump_diff(self, diff):
+        return json.dumps(diff, indent=4)
+
+
+BOM_LINE = None     # "qty x sku label" regex, compiled on first use: re is only needed by diff_bom
+
+
+def parse_bom_text(text):
+    # returns the BomLine (qty, sku, label) lines of a BOM entered in the Order Information sheet, and the lines ignored
+    global BOM_LINE
+    if BOM_LINE is None:
+        import re
+        BOM_LINE = re.compile(r"^(\d+)\s* x \s*(.*?) \s*(.*)$")    # label possibly starting with "* "
+    bom_lines = []
+    ignored = []
+    for line in (x.strip() for x in text.splitlines()):
+        if not line:
+            continue
+        m = BOM_LINE.match(line)
+        if m:
+            if m.group(3)[:2] == "* ":
+                bom_lines.append(sarrecords.BomLine(int(m.group(1)), m.group(2), m.group(3)[2:]))
+            else:
+                bom_lines.append(sarrecords.BomLine(int(m.group(1)), m.group(2), m.group(3)))
+        else:
+            ignored.append(line)
+    return bom_lines, ignored
+
+
+def bom_line_dict(line):
+    return collections.OrderedDict((("qty", line.qty), ("sku", line.sku), ("label", line.label)))
+
+
+def diff_bom_lines(bom_fromxls, bom_generated, near=False):
+    # Multiset difference of two lists of BomLine (qty, sku, label) lines, in linear time. Each XLS line cancels out one
+    # identical generated line. Returns the lines left on each side, in their original order. With near=True,
+    # leftover lines of the same sku on both sides are reported as a quantity delta instead.
+    generated_count = collections.Counter(bom_generated)
+    matched = collections.Counter()
+    only_xls = []
+    for line in bom_fromxls:
+        if matched[line] < generated_count[line]:
+            matched[line] += 1
+        else:
+            only_xls.append(line)
+    only_generated = []
+    for line in bom_generated:
+        if matched[line] > 0:     # the first occurrences are the ones matched by XLS lines
+            matched[line] -= 1
+        else:
+            only_generated.append(line)
+    diff = collections.OrderedDict()
+    if near:
+        xls_qty = collections.Counter()
+        generated_qty = collections.Counter()
+        for line in only_xls:
+            xls_qty[line.sku] += line.qty
+        for line in only_generated:
+            generated_qty[line.sku] += line.qty
+        deltas = collections.OrderedDict()
+        for qty, sku, label in only_generated:
+            if sku in xls_qty and sku not in deltas:
+                deltas[sku] = collections.OrderedDict((("sku", sku), ("label", label), ("xls qty", xls_qty[sku]),
+                                                       ("generated qty", generated_qty[sku]),
+                                                       ("delta", generated_qty[sku] - xls_qty[sku])))
+        only_xls = [line for line in only_xls if line.sku not in deltas]
+        only_generated = [line for line in only_generated if line.sku not in deltas]
+        diff["quantity deltas"] = list(deltas.values())
+    diff["in XLS but not generated"] = [bom_line_dict(line) for line in only_xls]
+    diff["generated but not in XLS"] = [bom_line_dict(line) for line in only_generated]
+    return diff
+
+
+def render_diff(diff):
+    # text report of the result of diff_bom
+    lines = []
+    for rack, rackdiff in diff.items():
+        lines.append(rack + ":")
+        for line in rackdiff["ignored lines"]:
+            lines.append("Ignored line: " + line)
+        for line in rackdiff["in XLS but not generated"]:
+            lines.append('in XLS but not generated:    {0:3} x  {1:7}  {2}'.format(str(line["qty"]), line["sku"], line["label"]))
+        for delta in rackdiff.get("quantity deltas", []):
+            lines.append('quantity differs:            {0:3} -> {1:3} ({2:+d})  {3:7}  {4}'.format(
+                str(delta["xls qty"]), str(delta["generated qty"]), delta["delta"], delta["sku"], delta["label"]))
+        for line in rackdiff["generated but not in XLS"]:
+            lines.append('generated but not in XLS:    {0:3} x  {1:7}  {2}'.format(str(line["qty"]), line["sku"], line["label"]))
+        lines.append("")
+    return "".join(line + "\n" for line in lines)
+
 
 ######## MAIN #########
+def is_batch_path(path):
+    return os.path.isdir(path) or any(c in path for c in "*?[")
+
+
+def write_timings(report, timings_file):
+    # timings go to stderr or to a JSON file so that stdout stays unchanged
+    if timings_file == "-":
+        print("timings: " + json.dumps(report, indent=4), file=sys.stderr)
+    else:
+        with open(timings_file, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+def load_config_or_sar(config_or_sar_file, partslist_file, rules_file, use_cache=True):
+    # SARconfig of a SAR file, or of a config saved as JSON by "sar config"
+    if config_or_sar_file.lower().endswith(".json"):
+        with open(config_or_sar_file) as f:
+            config = json.load(f, object_pairs_hook=collections.OrderedDict)
+        return SARconfig(config=config, partslist_file=partslist_file, rules_file=rules_file)
+    cache = sarcache.SARCache() if use_cache else None
+    return SARconfig(config_or_sar_file, partslist_file, cache=cache, rules_file=rules_file)
+
+
+def write_output(output_file, text):
+    with open(output_file, "w") as f:
+        f.write(text)
+
+
+def command_output(sar, command, output_format="text", near=False, timer=sartimer.NULL_TIMER):
+    # text printed by a command for one SAR, shared by the CLI and the "sar serve" daemon
+    if command == "config":
+        with timer.stage("dump_config"):
+            return sar.dump_config() + "\n"
+    elif command == "bom":
+        with timer.stage("print_bom"):
+            if output_format == "json":
+                return sar.dump_bom(compact=True) + "\n"
+            return sar.render_bom()
+    elif command == "diff":
+        with timer.stage("diff_bom"):
+            diff = sar.diff_bom(near=near)
+            if output_format == "json":
+                return sar.dump_diff(diff) + "\n"
+            return render_diff(diff)
+    elif command == "all":
+        with timer.stage("dump_all"):
+            return sar.dump_all(near=near) + "\n"
+    raise SARError("Unknown command: " + command)
+
+
+def write_output_files(sar, args, timer):
+    # --config-out, --bom-out, --bom-text-out and --diff-out all reuse the SAR parsed once
+    if args.config_out:
+        with timer.stage("dump_config"):
+            write_output(args.config_out, sar.dump_config() + "\n")
+    if args.bom_out:
+        with timer.stage("dump_bom"):
+            write_output(args.bom_out, sar.dump_bom(compact=True) + "\n")
+    if args.bom_text_out:
+        with timer.stage("print_bom"):
+            write_output(args.bom_text_out, sar.render_bom())
+    if args.diff_out:
+        with timer.stage("diff_bom"):
+            diff = sar.diff_bom(near=args.near)
+            if args.format == "json":
+                write_output(args.diff_out, sar.dump_diff(diff) + "\n")
+            else:
+                write_output(args.diff_out, render_diff(diff))
+
+
 def main(argv):
-    sar_file = parts_file = ""
-    bom = config = False
+    import argparse    # not needed by the modules importing sar (batch workers, daemon, HTTP service)
     parser = argparse.ArgumentParser(prog='sar', usage='%(prog)s command sarfile [options]')
-    parser.add_argument("command", type=str, action='store', choices=['config','bom','diff'], help="command")
-    parser.add_argument("sarfile", type=str, help="sar file")
+    parser.add_argument("command", type=str, action='store', choices=['config','bom','diff','all','serve','watch','rollup','sweep','ingest','query'],
+                        help="command, 'all' prints config, BOM and diff as one JSON document, "
+                             "'serve' starts a daemon that keeps the parts list and parsed SARs in memory, "
+                             "'watch' keeps the outputs of the SARs of a directory up to date, "
+                             "'rollup' totals the parts of a directory/glob of SARs as CSV (or JSON with -f json), "
+                             "'sweep' prints the BOM of a rack for each combination of --param values, "
+                             "'ingest' stores SARs and their BOMs in the SQLite database (--db), 'query' searches it")
+    parser.add_argument("sarfile", type=str, nargs='?', help="sar file, or directory/glob of sar files for batch mode")
     parser.add_argument("-p", "--partsfile", action="store", nargs='?', default="./CatC-partslist.json")
-    args = parser.parse_args()
-    if not os.path.isfile(args.sarfile):
+    parser.add_argument("-r", "--rulesfile", action="store", nargs='?', default=None, help="BOM rules file (default: next to the parts file)")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=None, help="number of worker processes in batch mode")
+    parser.add_argument("-f", "--format", action="store", choices=['text', 'json'], default="text", help="output format")
+    parser.add_argument("--near", action="store_true", help="diff: report quantity deltas for parts found on both sides")
+    parser.add_argument("--config-out", action="store", default=None, help="also write the config as JSON to this file")
+    parser.add_argument("--bom-out", action="store", default=None, help="also write the BOM as JSON to this file")
+    parser.add_argument("--bom-text-out", action="store", default=None, help="also write the BOM as text to this file")
+    parser.add_argument("--diff-out", action="store", default=None, help="also write the diff to this file (text, or JSON with -f json)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the cache of parsed SAR files")
+    parser.add_argument("--cache-stats", action="store_true", help="print cache hits/misses to stderr")
+    parser.add_argument("--outputs", action="store", default="bom",
+                        help="watch: comma separated outputs written next to each SAR (config, bom, diff, all)")
+    parser.add_argument("--interval", action="store", type=float, default=2.0, help="watch: seconds between two scans")
+    parser.add_argument("--once", action="store_true", help="watch: scan the directory once and exit")
+    parser.add_argument("--group-by", action="store", default="country,indirect",
+                        help="rollup: comma separated customer keys the totals are broken down by")
+    parser.add_argument("--rack", action="store", default="rack1", help="sweep: rack whose parameters vary")
+    parser.add_argument("--param", action="append", default=[],
+                        help="sweep: rack parameter and its values, e.g. 'compute qty=0..16:4' or 'pdu type=A|B', repeatable")
+    parser.add_argument("--params", action="store", default=None,
+                        help="sweep: JSON file of rack parameters and their values, e.g. {\"oasg qty\": [0, 1, 2]}")
+    parser.add_argument("--stats", action="store_true",
+                        help="sweep: print the number of variants per second to stderr, query: print the query time")
+    parser.add_argument("--db", action="store", default=None,
+                        help="ingest/query: SQLite database of the ingested SARs (default: $SAR_DB or sars.db in the cache directory)")
+    parser.add_argument("--sku", action="store", default=None, help="query: SARs whose BOM contains this SKU")
+    parser.add_argument("--customer", action="store", default=None, help="query: SARs of this customer")
+    parser.add_argument("--country", action="store", default=None, help="query: SARs of this country")
+    parser.add_argument("--release", action="store", type=int, default=None, help="query: SARs of this SAR release")
+    parser.add_argument("--socket", action="store", default=sardaemon.default_socket_path(),
+                        help="unix socket of the daemon started with 'serve', used by the other commands when it is running")
+    parser.add_argument("--no-daemon", action="store_true", help="do not send the command to the daemon")
+    parser.add_argument("--timings", action="store", nargs='?', const="-", default=None,
+                        help="report wall/CPU time and peak memory of each stage to stderr, or to the given JSON file")
+    parser.add_argument("--profile", action="store", default=None, help="write a cProfile dump of the whole run to this file")
+    args = parser.parse_args(argv)
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, args)
+        finally:
+            profiler.dump_stats(args.profile)
+    else:
+        run(args)
+
+
+def run(args):
+    if args.command == "serve":
+        sardaemon.serve(args.socket, args.partsfile if os.path.isfile(args.partsfile) else None, args.rulesfile,
+                        use_cache=not args.no_cache)
+        return
+    if args.command == "query":
+        import sqlite3
+        import sarstore
+        import time
+        start = time.perf_counter()
+        try:
+            rows = sarstore.query(args.db or sarstore.default_db_path(), sku=args.sku, customer=args.customer,
+                                  country=args.country, release=args.release)
+        except (sarstore.StoreError, sqlite3.Error) as e:
+            sys.exit(str(e))
+        if args.stats:
+            print("query: {0} SARs in {1:.1f} ms".format(len(rows), (time.perf_counter() - start) * 1000), file=sys.stderr)
+        dump = sarstore.dump_json if args.format == "json" else sarstore.dump_csv
+        sys.stdout.write(dump(rows, args.sku) + ("\n" if args.format == "json" else ""))
+        return
+    if args.sarfile is None:
+        print("A SAR file is required for the " + args.command + " command")
+        sys.exit()
+    batch = is_batch_path(args.sarfile)
+    if not batch and not os.path.isfile(args.sarfile):
         print("Specified SAR file is not found: " + args.sarfile)
         sys.exit()
     if not os.path.isfile(args.partsfile):
         print("Parts file is not found: " + args.partsfile)
         sys.exit()
-    sar = SARconfig(args.sarfile, args.partsfile)
-    if args.command == "config":
-        print(sar.dump_config())
-    elif args.command == "bom":
-        #print(sar.dump_bom())
-        sar.print_bom()
-    elif args.command == "diff":
-        sar.diff_bom()
-    else:
-        usage()
+    rules_file = args.rulesfile or default_rules_file(args.partsfile)
+    if not os.path.isfile(rules_file):
+        print("BOM rules file is not found: " + rules_file)
         sys.exit()
+    if args.command == "rollup":
+        import sarrollup
+        group_by = tuple(key for key in args.group_by.split(",") if key)
+        if not set(group_by) <= set(sarrollup.CUSTOMER_KEYS):
+            print("The rollup can be broken down by: " + ", ".join(sarrollup.CUSTOMER_KEYS))
+            sys.exit()
+        matrix = sarrollup.rollup(args.sarfile, args.partsfile, rules_file, jobs=args.jobs, use_cache=not args.no_cache,
+                                  group_by=group_by)
+        sys.stdout.write(matrix.dump_json() + "\n" if args.format == "json" else matrix.dump_csv())
+        return
+    if args.command == "ingest":
+        import sarstore
+        stored, skipped, errors = sarstore.ingest(args.sarfile, args.db or sarstore.default_db_path(), args.partsfile,
+                                                  rules_file, jobs=args.jobs, use_cache=not args.no_cache)
+        print("ingest: {0} SARs stored, {1} already stored, {2} errors".format(stored, skipped, errors), file=sys.stderr)
+        return
+    if args.command == "sweep":
+        import sarsweep
+        try:
+            params = collections.OrderedDict()
+            if args.params:
+                with open(args.params) as f:
+                    params.update(json.load(f, object_pairs_hook=collections.OrderedDict))
+            params.update(sarsweep.parse_param(param) for param in args.param)
+            if not params:
+                raise sarsweep.SweepError("No parameter to sweep, use --param or --params")
+            sar = load_config_or_sar(args.sarfile, args.partsfile, rules_file, not args.no_cache)
+            sarsweep.run_sweep(sar, args.rack, params, args.partsfile, rules_file, jobs=args.jobs, stats=args.stats)
+        except (SARError, sarrules.RuleError, sarsweep.SweepError, ValueError) as e:
+            sys.exit(str(e))
+        return
+    if args.command == "watch":
+        import sarwatch
+        commands = args.outputs.split(",")
+        if not os.path.isdir(args.sarfile) or not set(commands) <= set(sarwatch.OUTPUT_SUFFIXES):
+            print("watch needs a directory and outputs among: " + ", ".join(sarwatch.OUTPUT_SUFFIXES))
+            sys.exit()
+        watcher = sarwatch.SARWatcher(args.sarfile, args.partsfile, rules_file, commands, use_cache=not args.no_cache,
+                                      near=args.near)
+        if args.once:
+            watcher.scan()
+        else:
+            watcher.watch(args.interval)
+        return
+    output_files = any((args.config_out, args.bom_out, args.bom_text_out, args.diff_out))
+    if batch:
+        if output_files:
+            print("Output files are not supported in batch mode")
+            sys.exit()
+        import sarbatch
+        sarbatch.run_batch(args.command, args.sarfile, args.partsfile, rules_file, jobs=args.jobs,
+                           use_cache=not args.no_cache, cache_stats=args.cache_stats, timings=args.timings is not None,
+                           near=args.near)
+        return
+    if not (output_files or args.no_daemon or args.no_cache or args.timings or args.profile):
+        # served by the daemon when it is running, in-process otherwise
+        response = sardaemon.request(args.socket, {"command": args.command, "sarfile": os.path.abspath(args.sarfile),
+                                                   "partsfile": os.path.abspath(args.partsfile),
+                                                   "rulesfile": os.path.abspath(rules_file),
+                                                   "format": args.format, "near": args.near,
+                                                   "cache_stats": args.cache_stats})
+        if response is not None:
+            if "error" in response:
+                sys.exit(response["error"])
+            if "cache" in response:
+                print("cache: " + json.dumps(response["cache"]), file=sys.stderr)
+            sys.stdout.write(response["output"])
+            return
+    timer = sartimer.StageTimer() if args.timings else sartimer.NULL_TIMER
+    cache = None if args.no_cache else sarcache.SARCache()
+    try:
+        sar = SARconfig(args.sarfile, args.partsfile, cache=cache, rules_file=rules_file, timer=timer)
+    except (SARError, sarrules.RuleError) as e:
+        sys.exit(str(e))
+    if args.cache_stats and cache is not None:
+        print("cache: " + json.dumps(cache.stats()), file=sys.stderr)
+    if not (args.command == "all" and output_files):     # with output files, "all" only writes them
+        sys.stdout.write(command_output(sar, args.command, args.format, args.near, timer))
+    write_output_files(sar, args, timer)
+    if args.timings:
+        write_timings(timer.report(), args.timings)
 
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):   # py2exe/py2app bundles need this for the batch worker processes
+        import multiprocessing
+        multiprocessing.freeze_support()
     main(sys.argv[1:])
@@ -1,7 +1,273 @@
 from flask import Flask, request, Response
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
 import json
+import os
+import tempfile
+import threading
+import uuid
+
+import sar
+import sarbatch
+import sarrecords
+import sarsweep
 
 app = Flask(__name__)
+app.config.update(
+    SAR_PARTSFILE=os.environ.get("SAR_PARTSFILE", "./CatC-partslist.json"),
+    SAR_RULESFILE=os.environ.get("SAR_RULESFILE"),           # default: next to the parts file
+    SAR_WORKERS=int(os.environ.get("SAR_WORKERS", os.cpu_count() or 1)),      # worker processes parsing SAR files
+    SAR_MAX_PENDING=int(os.environ.get("SAR_MAX_PENDING", 2 * (os.cpu_count() or 1))),   # requests queued or running before 503
+    SAR_TIMEOUT=float(os.environ.get("SAR_TIMEOUT", 60)),    # seconds to wait for a SAR to be processed
+    SAR_USE_CACHE=os.environ.get("SAR_NO_CACHE", "") == "",
+    SAR_MAX_VARIANTS=int(os.environ.get("SAR_MAX_VARIANTS", 10000)),    # largest what-if grid accepted by /sweep
+    SAR_MAX_UPLOAD=int(os.environ.get("SAR_MAX_UPLOAD", 32)) * 1024 * 1024,   # largest SAR workbook accepted, in bytes
+    SAR_MAX_JOBS=int(os.environ.get("SAR_MAX_JOBS", 1000)),   # finished jobs kept for GET /jobs/<id>
+    MAX_CONTENT_LENGTH=int(os.environ.get("SAR_MAX_UPLOAD", 32)) * 1024 * 1024 + 64 * 1024,   # multipart overhead
+)
+
+UPLOAD_CHUNK = 64 * 1024      # bytes read from the request at once
+XLSX_MAGIC = b"PK\x03\x04"     # .xlsx workbooks are zip files, .xls ones are not
+
+executor = None
+executor_lock = threading.Lock()
+pending = None      # semaphore limiting the number of SAR files being processed or waiting for a worker
+jobs = collections.OrderedDict()    # job id -> Job, oldest first
+jobs_by_key = {}    # (SAR content hash, command, options) -> Job, so that the same SAR is only processed once
+jobs_lock = threading.Lock()
+
+
+def get_executor():
+    # worker pool created on first use, and again after a worker process died; each worker keeps the parts list and
+    # the BOM rules loaded
+    global executor, pending
+    with executor_lock:
+        if executor is None:
+            partslist_file = app.config["SAR_PARTSFILE"]
+            rules_file = app.config["SAR_RULESFILE"] or sar.default_rules_file(partslist_file)
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=app.config["SAR_WORKERS"], initializer=sarbatch.init_worker,
+                initargs=(partslist_file, rules_file, app.config["SAR_USE_CACHE"]))
+        if pending is None:     # kept with a new pool: the jobs of the old one give their slots back when they fail
+            pending = threading.BoundedSemaphore(app.config["SAR_MAX_PENDING"])
+        return executor
+
+
+def discard_executor(pool):
+    # a worker process died (e.g. killed for using too much memory) and the pool is not usable anymore: the next
+    # get_executor() starts a new one
+    global executor
+    with executor_lock:
+        if executor is pool:
+            executor = None
+    pool.shutdown(wait=False)
+
+
+def submit(fn, *args):
+    # runs fn(*args) in the worker pool, started again when a dead worker broke it
+    pool = get_executor()
+    try:
+        future = pool.submit(fn, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        discard_executor(pool)
+        pool = get_executor()
+        future = pool.submit(fn, *args)
+
+    def check_pool(future):
+        if not future.cancelled() and isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+            discard_executor(pool)
+
+    future.add_done_callback(check_pool)
+    return future
+
+
+def json_response(body, status):
+    return Response(json.dumps(body, indent=4, default=sarrecords.to_json), status=status, mimetype='application/json')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def spool_upload(max_size):
+    # Streams the SAR workbook, sent either as the "sarfile" field of a multipart form or as the raw request body,
+    # to a temporary file in chunks and hashes it on the way. Returns (path, sha256, size).
+    # request.files is only looked at for multipart forms: for any other body, e.g. curl --data-binary which sends
+    # it as application/x-www-form-urlencoded, Werkzeug would parse (and buffer) it as a form
+    if request.mimetype == "multipart/form-data" and "sarfile" in request.files:
+        stream = request.files["sarfile"].stream
+    else:
+        stream = request.stream     # already read by the form parser for a form without sarfile: empty upload
+    first = stream.read(UPLOAD_CHUNK)
+    fd, path = tempfile.mkstemp(suffix=".xlsx" if first.startswith(XLSX_MAGIC) else ".xls")
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            chunk = first
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge()
+                sha256.update(chunk)
+                f.write(chunk)
+                chunk = stream.read(UPLOAD_CHUNK)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, sha256.hexdigest(), size
+
+
+class Job:
+    # SAR file processed by the worker pool, polled with GET /jobs/<id>
+    def __init__(self, command, key, future):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.key = key
+        self.future = future
+
+    @property
+    def crashed(self):
+        # not processed at all (cancelled, worker process died...), unlike a SAR file that failed to parse
+        return self.future.done() and (self.future.cancelled() or self.future.exception() is not None)
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+        return "failed" if self.crashed or "error" in self.future.result()[0] else "done"
+
+    def to_dict(self):
+        resp = collections.OrderedDict()
+        resp["job"] = self.id
+        resp["command"] = self.command
+        resp["status"] = self.status
+        if self.future.done():
+            resp["result"] = job_result(self.future)
+        return resp
+
+
+def job_result(future):
+    if future.cancelled():
+        return {"error": "SAR file processing cancelled"}
+    if future.exception() is not None:    # e.g. a worker process died
+        return {"error": sarbatch.error_message(future.exception())}
+    result = collections.OrderedDict(future.result()[0])
+    result.pop("sarfile", None)     # temporary file name, meaningless to the client
+    return result
+
+
+def forget_old_jobs():
+    # keeps at most SAR_MAX_JOBS finished jobs, the oldest ones are forgotten first (called with jobs_lock held)
+    finished = [job for job in jobs.values() if job.future.done()]
+    for job in finished[:max(0, len(finished) - app.config["SAR_MAX_JOBS"])]:
+        del jobs[job.id]
+        if jobs_by_key.get(job.key) is job:
+            del jobs_by_key[job.key]
+
+
+def submit_job(command, path, key, timings, near):
+    # Returns the job processing the SAR, or an existing one when the same SAR was already submitted with the same
+    # options (the upload is then not needed). Called with a pending slot reserved, which is released when the job
+    # finishes, or at once when an existing job is returned.
+    def finished(future):
+        pending.release()
+        os.remove(path)
+
+    with jobs_lock:     # lookup and registration in one go, so that concurrent uploads of a SAR share one job
+        job = jobs_by_key.get(key)
+        if job is not None and not job.crashed:
+            pending.release()
+            os.remove(path)
+            return job
+        try:
+            future = submit(sarbatch.sar_file_result, command, path, timings, near)
+        except BaseException:
+            pending.release()
+            os.remove(path)
+            raise
+        future.add_done_callback(finished)
+        job = Job(command, key, future)
+        jobs[job.id] = job
+        jobs_by_key[key] = job
+        forget_old_jobs()
+    return job
+
+
+@app.route("/<any(config, bom, diff, all):command>", methods=['POST'])
+def process_sar(command):
+    # ?async=1 answers 202 with the job to poll at once, otherwise the result is returned when the job is done
+    get_executor()
+    if not pending.acquire(blocking=False):     # before reading the upload, so that a busy service answers at once
+        resp = json_response({"error": "too many SAR files being processed, retry later"}, 503)
+        resp.headers["Retry-After"] = "1"
+        return resp
+    try:
+        path, sar_hash, size = spool_upload(app.config["SAR_MAX_UPLOAD"])
+    except UploadTooLarge:
+        pending.release()
+        return json_response({"error": "SAR file larger than {0} bytes".format(app.config["SAR_MAX_UPLOAD"])}, 413)
+    except BaseException:
+        pending.release()
+        raise
+    if size == 0:
+        pending.release()
+        os.remove(path)
+        return json_response({"error": "no SAR file uploaded"}, 400)
+    timings = request.args.get("timings", "") not in ("", "0")    # ?timings=1 adds the per-stage timings to the result
+    near = request.args.get("near", "") not in ("", "0")          # ?near=1 reports quantity deltas in diffs
+    job = submit_job(command, path, (sar_hash, command, timings, near), timings, near)
+    if request.args.get("async", "") not in ("", "0"):
+        resp = json_response(job.to_dict(), 202)
+        resp.headers["Location"] = "/jobs/" + job.id
+        return resp
+    try:
+        job.future.result(timeout=app.config["SAR_TIMEOUT"])
+    except concurrent.futures.TimeoutError:
+        return json_response({"error": "SAR file processing timed out", "job": job.id}, 504)   # can still be polled
+    except Exception:
+        pass    # reported in the result
+    result = job_result(job.future)
+    return json_response(result, 422 if "error" in result else 200)
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return json_response({"error": "no such job"}, 404)
+    return json_response(job.to_dict(), 200)
+
+
+@app.route("/sweep", methods=['POST'])
+def sweep():
+    # JSON body: {"config": config as returned by /config, "rack": "rack1", "params": {"compute qty": [4, 8], ...}}
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("config"), dict) or not isinstance(body.get("params"), dict):
+        return json_response({"error": "expected a JSON body with config, rack and params"}, 400)
+    get_executor()
+    if not pending.acquire(blocking=False):
+        resp = json_response({"error": "too many requests being processed, retry later"}, 503)
+        resp.headers["Retry-After"] = "1"
+        return resp
+    try:
+        future = submit(sarsweep.sweep_result, body["config"], body.get("rack", "rack1"), body["params"],
+                        app.config["SAR_MAX_VARIANTS"])
+    except BaseException:
+        pending.release()
+        raise
+    # released when the worker is done: a sweep that timed out keeps running, and keeps its slot, until it ends
+    future.add_done_callback(lambda future: pending.release())
+    try:
+        result = future.result(timeout=app.config["SAR_TIMEOUT"])
+    except concurrent.futures.TimeoutError:
+        future.cancel()     # only if it is still queued
+        return json_response({"error": "sweep timed out"}, 504)
+    return json_response(result, 422 if "error" in result else 200)
+
 
 @app.route("/get", methods=['GET'])
 def get_network_info():
@@ -21,25 +287,21 @@ def get_network_info():
 @app.route("/put", methods=['PUT'])
 def check_network_info():
     resp = {}
-    print(request.data)
     if not request.json:
         resp["error"] = 'no json payload'
         return Response(json.dumps(resp, indent=4), status=404)
     else:
         resp["Ok"] = request.json["param"]
-        return Response(json.dumps(resp, indent=4), status=201, mimetype='application/json') */
+        return Response(json.dumps(resp, indent=4), status=201, mimetype='application/json')
 
-@app.route("/", methods=['GET','POST','PUT'])
-def check_network_info():
+
+@app.route("/", methods=['GET'])
+def status():
     resp = {}
-    print(request.__dict__)
-    if not request.json:
-        resp["error"] = 'no json payload'
-        return Response(json.dumps(resp, indent=4), status=404)
-    else:
-        resp["Ok"] = request.json["param"]
-        return Response(json.dumps(resp, indent=4), status=201, mimetype='application/json')
+    resp["status"] = "ok"
+    resp["commands"] = ["/config", "/bom", "/diff", "/all", "/sweep", "/jobs/<id>"]
+    return Response(json.dumps(resp, indent=4), status=200, mimetype='application/json')
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, threaded=True)
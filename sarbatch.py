@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import collections
+import concurrent.futures
+import functools
+import glob
+import json
+import os
+import os.path
+import sys
+
+import sar
+import sarcache
+import sarrecords
+import sartimer
+
+SAR_FILE_EXTENSIONS = (".xls", ".xlsx")
+
+worker_parts = None     # parts list, loaded once in each worker process
+worker_cache = None     # cache of parsed SAR files, shared on disk by all the workers
+worker_rules = None     # compiled BOM rules, loaded once in each worker process
+
+
+def list_sar_files(path):
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(SAR_FILE_EXTENSIONS)]
+    else:
+        files = glob.glob(path)
+    return sorted(f for f in files if os.path.isfile(f))   # sorted so that results come out in a deterministic order
+
+
+def init_worker(partslist_file, rules_file, use_cache=True):
+    global worker_parts, worker_cache, worker_rules
+    worker_parts = sar.SARconfig.load_parts(partslist_file)
+    worker_rules = sar.SARconfig.load_rules(rules_file)
+    worker_cache = sarcache.SARCache() if use_cache else None
+
+
+def error_message(e):
+    # how the error of a SAR that failed is reported in the batch results, e.g. "KeyError: 'rack1'"
+    return "{0}: {1}".format(type(e).__name__, e)
+
+
+def sar_file_result(command, sar_file, timings=False, near=False):
+    # returns the result for the SAR as a dictionary and whether it was served from the cache
+    result = collections.OrderedDict()
+    result["sarfile"] = sar_file
+    cache_hit = False
+    timer = sartimer.StageTimer() if timings else sartimer.NULL_TIMER
+    try:
+        sarconfig = sar.SARconfig(sar_file, parts=worker_parts, cache=worker_cache, rules=worker_rules, timer=timer)
+        cache_hit = sarconfig.cache_hit
+        if command == "config":
+            result["config"] = sarconfig.config
+        elif command == "bom":
+            result["bom"] = sarconfig.bom
+        elif command == "diff":
+            with timer.stage("diff_bom"):
+                result["diff"] = sarconfig.diff_bom(near=near)
+        elif command == "all":
+            result["config"] = sarconfig.config
+            result["bom"] = sarconfig.bom
+            with timer.stage("diff_bom"):
+                result["diff"] = sarconfig.diff_bom(near=near)
+    except Exception as e:     # a bad SAR must not stop the rest of the batch
+        result["error"] = error_message(e)
+    if timings:
+        result["timings"] = timer.report()
+    return result, cache_hit
+
+
+def process_sar_file(command, sar_file, timings=False, near=False):
+    # returns the JSON line for the SAR and whether it was served from the cache
+    result, cache_hit = sar_file_result(command, sar_file, timings, near)
+    return json.dumps(result, default=sarrecords.to_json), cache_hit
+
+
+def map_sar_files(func, sar_files, partslist_file, rules_file, jobs=None, use_cache=True):
+    # yields func(sar_file) for each SAR file, in the order of sar_files, computed by worker processes that have the
+    # parts list and BOM rules loaded (func must be picklable, e.g. a module function or a functools.partial of one)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(sar_files) <= 1:
+        init_worker(partslist_file, rules_file, use_cache)
+        for sar_file in sar_files:
+            yield func(sar_file)
+        return
+    chunksize = max(1, min(16, len(sar_files) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                                initargs=(partslist_file, rules_file, use_cache)) as executor:
+        for result in executor.map(func, sar_files, chunksize=chunksize):
+            yield result
+
+
+def process_sar_files(command, sar_files, partslist_file, rules_file, jobs=None, use_cache=True, timings=False,
+                      near=False):
+    # yields (JSON line, cache hit) per SAR file, in the order of sar_files
+    func = functools.partial(process_sar_file, command, timings=timings, near=near)
+    return map_sar_files(func, sar_files, partslist_file, rules_file, jobs, use_cache)
+
+
+def run_batch(command, path, partslist_file, rules_file, jobs=None, use_cache=True, cache_stats=False, timings=False,
+              near=False, out=sys.stdout):
+    sar_files = list_sar_files(path)
+    if not sar_files:
+        print("No SAR file found: " + path, file=sys.stderr)
+        return
+    hits = 0
+    for line, cache_hit in process_sar_files(command, sar_files, partslist_file, rules_file, jobs=jobs,
+                                                 use_cache=use_cache, timings=timings, near=near):
+        out.write(line + "\n")
+        out.flush()
+        hits += cache_hit
+    if cache_stats and use_cache:
+        print("cache: " + json.dumps({"hits": hits, "misses": len(sar_files) - hits}), file=sys.stderr)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import gc
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sar
+import sargen
+import sarparts
+import sarrecords
+import sarsweep
+import sartimer
+
+STAGES = ("open_workbook", "load_parts", "load_customer_info", "load_subscription_info", "load_rack_info",
+          "build_bom", "print_bom", "diff_bom")
+
+
+def best_time(func, repeat):
+    # best wall time of repeat calls, in milliseconds
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_parts(partslist_file, repeat):
+    def load_json():
+        with open(partslist_file) as f:
+            json.load(f, object_pairs_hook=collections.OrderedDict)
+
+    def load_catalog():
+        sarparts.load_catalog(partslist_file)
+
+    sarparts.load_catalog(partslist_file)   # make sure the snapshot exists
+    result = collections.OrderedDict()
+    result["json OrderedDict ms"] = best_time(load_json, repeat)
+    result["compiled catalog ms"] = best_time(load_catalog, repeat)
+    return result
+
+
+def bench_stages(sar_files, partslist_file):
+    # processes the SAR files like "sar config", "sar bom" and "sar diff" would, without the cache
+    timer = sartimer.StageTimer(memory=False)
+    racks = 0
+    start = time.perf_counter()
+    rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+    for sar_file in sar_files:
+        sarconfig = sar.SARconfig(sar_file, partslist_file, rules=rules, timer=timer)
+        with timer.stage("print_bom"):
+            sarconfig.render_bom()
+        with timer.stage("diff_bom"):
+            sarconfig.diff_bom()
+        racks += len(sarconfig.config["hw"])
+    total = time.perf_counter() - start
+    result = collections.OrderedDict()
+    result["files"] = len(sar_files)
+    result["racks"] = racks
+    result["total s"] = total
+    result["files/s"] = len(sar_files) / total
+    result["stages"] = collections.OrderedDict()
+    for stage in STAGES:
+        timings = timer.stages.get(stage, {"wall ms": 0.0, "cpu ms": 0.0})
+        result["stages"][stage] = collections.OrderedDict((("total ms", timings["wall ms"]),
+                                                           ("per file ms", timings["wall ms"] / len(sar_files)),
+                                                           ("cpu ms", timings["cpu ms"])))
+    return result
+
+
+def bench_backends(count, partslist_file, directory, seed):
+    # reads the same generated SARs as .xls (xlrd) and as .xlsx (openpyxl streaming reader): wall time of each
+    # reading stage, then peak Python memory in a second pass since tracemalloc slows everything down
+    parts = sar.SARconfig.load_parts(partslist_file)
+    rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+    stages = ("open_workbook", "load_customer_info", "load_subscription_info", "load_rack_info", "load_order_information")
+    result = collections.OrderedDict()
+    for extension in (".xls", ".xlsx"):
+        sar_files = sargen.generate(directory, count, seed, partslist_file, extension=extension)
+        backend = collections.OrderedDict()
+        sar.SARconfig(sar_files[0], parts=parts, rules=rules).close()     # backend imported before measuring
+        for memory in (False, True):
+            timer = sartimer.StageTimer(memory=memory)
+            start = time.perf_counter()
+            for sar_file in sar_files:
+                sarconfig = sar.SARconfig(sar_file, parts=parts, rules=rules, timer=timer)
+                with timer.stage("load_order_information"):
+                    sarconfig.load_order_information()
+                if memory:
+                    gc.collect()    # per file peak, not the garbage left by the previous files
+            total = time.perf_counter() - start
+            if memory:
+                tracemalloc.stop()      # the next backend starts from zero
+                backend["peak KB"] = max(timer.stages[stage]["peak KB"] for stage in stages)
+            else:
+                backend["files"] = len(sar_files)
+                backend["per file ms"] = total * 1000 / len(sar_files)
+                backend["stages per file ms"] = collections.OrderedDict(
+                    (stage, timer.stages[stage]["wall ms"] / len(sar_files)) for stage in stages)
+        result[extension] = backend
+    return result
+
+
+def bench_sweep(sar_files, partslist_file, jobs=None):
+    # what-if sweep of rack1 of each SAR over a 17x5x3x4x4 grid (4080 variants, enough to be split between worker
+    # processes), JSON encoding included, in one process and with jobs worker processes (default: one per CPU)
+    params = collections.OrderedDict((("compute qty", list(range(17))), ("block ssd qty", list(range(5))),
+                                      ("oasg qty", [0, 1, 2]), ("upstream cable count", [0, 2, 4, 8]),
+                                      ("upstream cable length", ["5m", "10m", "20m", "50m"])))
+    rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+    sarconfigs = [sar.SARconfig(sar_file, partslist_file, rules=rules) for sar_file in sar_files]
+    jobs = jobs or os.cpu_count() or 1
+    result = collections.OrderedDict()
+    result["files"] = len(sar_files)
+    for name, run_jobs in (("single", 1), ("parallel", jobs)):
+        variants = 0
+        start = time.perf_counter()
+        for sarconfig in sarconfigs:
+            for line in sarsweep.sweep_lines(sarconfig, "rack1", params, partslist_file, jobs=run_jobs):
+                variants += 1
+        total = time.perf_counter() - start
+        result[name] = collections.OrderedDict((("jobs", run_jobs), ("variants", variants), ("total s", total),
+                                                ("variants/s", variants / total)))
+    return result
+
+
+def bench_memory(sar_files, partslist_file):
+    # memory kept by the parsed configs of a batch of SARs: customer info and racks as plain dictionaries, as the
+    # parser used to return them, and as the sarrecords records it returns now
+    rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+    parts = sar.SARconfig.load_parts(partslist_file)
+    texts = []
+    racks = 0
+    for sar_file in sar_files:
+        sarconfig = sar.SARconfig(sar_file, parts=parts, rules=rules)
+        sarconfig.close()
+        texts.append(sarconfig.dump_config())
+        racks += len(sarconfig.config["hw"])
+    result = collections.OrderedDict()
+    result["files"] = len(sar_files)
+    result["racks"] = racks
+    for name, load in (("dicts", json.loads), ("records", lambda text: sarrecords.typed_config(json.loads(text)))):
+        gc.collect()
+        tracemalloc.start()
+        configs = [load(text) for text in texts]
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del configs
+        result[name + " KB"] = size / 1024
+        result[name + " bytes per rack"] = size / racks
+    result["records/dicts"] = result["records KB"] / result["dicts KB"]
+    return result
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package" lines of python -X importtime, nested imports being
+    # indented: returns {top level module: cumulative us} and the number of modules imported
+    top_level = collections.OrderedDict()
+    modules = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules += 1
+        if not name.startswith("  "):
+            top_level[name.strip()] = int(cumulative_us)
+    return top_level, modules
+
+
+def bench_startup(sar_file, partslist_file, repeat):
+    # startup of "sar.py config" (SAR in the cache, no daemon) as seen from the shell, and the time spent importing
+    # modules according to python -X importtime: whole process, all imports, the sar* modules imported by sar.py and
+    # the slowest imports
+    sar_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sar.py")
+    command = [sys.executable, "-X", "importtime", sar_py, "config", sar_file, "-p", partslist_file, "--no-daemon"]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)    # fill the cache
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        stderr = subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True).stderr
+        elapsed = (time.perf_counter() - start) * 1000
+        top_level, modules = parse_importtime(stderr)
+        imports = sum(top_level.values()) / 1000
+        if best is None or imports < best["imports ms"]:
+            best = collections.OrderedDict()
+            best["process ms"] = elapsed
+            best["imports ms"] = imports
+            best["sar modules ms"] = sum(us for name, us in top_level.items() if name.startswith("sar")) / 1000
+            best["modules"] = modules
+            best["slowest imports ms"] = collections.OrderedDict(
+                (name, us / 1000) for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:10])
+    return best
+
+
+def bench_daemon(sar_file, partslist_file, repeat):
+    # latency of "sar.py bom" as seen from the shell: cold in-process run, in-process run with the cache of parsed
+    # SARs, and run served by a warm "sar serve" daemon
+    sar_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sar.py")
+    command = [sys.executable, sar_py, "bom", sar_file, "-p", partslist_file]
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="sarbench"), "sar.sock")
+
+    def run(*options):
+        subprocess.run(command + list(options), check=True, stdout=subprocess.DEVNULL)
+
+    result = collections.OrderedDict()
+    result["in-process, no cache ms"] = best_time(lambda: run("--no-cache"), repeat)
+    run("--no-daemon")    # fill the cache
+    result["in-process, cached ms"] = best_time(lambda: run("--no-daemon"), repeat)
+    daemon = subprocess.Popen([sys.executable, sar_py, "serve", "--socket", socket_path, "-p", partslist_file],
+                              stderr=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        run("--socket", socket_path)    # first request parses the SAR in the daemon
+        result["daemon ms"] = best_time(lambda: run("--socket", socket_path), repeat)
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    return result
+
+
+######## MAIN #########
+def main(argv):
+    parser = argparse.ArgumentParser(prog='sarbench', usage='%(prog)s benchmark [options]')
+    parser.add_argument("benchmark", type=str, action='store', choices=['parts', 'stages', 'daemon', 'backends', 'sweep', 'memory', 'startup'], help="benchmark to run")
+    parser.add_argument("-p", "--partsfile", action="store", nargs='?', default="./CatC-partslist.json")
+    parser.add_argument("-n", "--repeat", action="store", type=int, default=200, help="number of runs, the best one is reported")
+    parser.add_argument("-c", "--counts", action="store", default="1,10,100,1000", help="comma separated numbers of SAR files")
+    parser.add_argument("-d", "--directory", action="store", default=os.path.join(tempfile.gettempdir(), "sarbench"),
+                        help="directory of the synthetic SAR files, generated if missing")
+    parser.add_argument("-s", "--seed", action="store", type=int, default=0)
+    parser.add_argument("-o", "--output", action="store", default=None, help="JSON results file (default: stdout)")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=None,
+                        help="worker processes of the parallel sweep (default: one per CPU)")
+    args = parser.parse_args(argv)
+    results = collections.OrderedDict()
+    results["python"] = platform.python_version()
+    results["platform"] = platform.platform()
+    if args.benchmark == "parts":
+        results["parts"] = bench_parts(args.partsfile, args.repeat)
+    elif args.benchmark == "stages":
+        counts = [int(count) for count in args.counts.split(",")]
+        sar_files = sargen.generate(args.directory, max(counts), args.seed, args.partsfile)
+        results["stages"] = [bench_stages(sar_files[:count], args.partsfile) for count in counts]
+    elif args.benchmark == "daemon":
+        sar_file = sargen.generate(args.directory, 1, args.seed, args.partsfile)[0]
+        results["daemon"] = bench_daemon(sar_file, args.partsfile, min(args.repeat, 20))
+    elif args.benchmark == "backends":
+        counts = [int(count) for count in args.counts.split(",")]
+        results["backends"] = bench_backends(max(counts), args.partsfile, args.directory, args.seed)
+    elif args.benchmark == "sweep":
+        counts = [int(count) for count in args.counts.split(",")]
+        results["sweep"] = bench_sweep(sargen.generate(args.directory, max(counts), args.seed, args.partsfile),
+                                       args.partsfile, args.jobs)
+    elif args.benchmark == "memory":
+        counts = [int(count) for count in args.counts.split(",")]
+        results["memory"] = bench_memory(sargen.generate(args.directory, max(counts), args.seed, args.partsfile),
+                                         args.partsfile)
+    elif args.benchmark == "startup":
+        sar_file = sargen.generate(args.directory, 1, args.seed, args.partsfile)[0]
+        results["startup"] = bench_startup(sar_file, args.partsfile, min(args.repeat, 20))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Workbook backends. SARconfig uses the subset of the xlrd API below, so the xlrd Book is used as is for .xls files
+# and XlsxWorkbook provides the same methods on top of openpyxl for .xlsx files:
+#   book.sheet_by_name(name), book.unload_sheet(name), book.release_resources()
+#   sheet.nrows, sheet.cell_value(rowx, colx), sheet.row_values(rowx, start_colx=0, end_colx=None),
+#   sheet.col_values(colx, start_rowx=0, end_rowx=None)
+# Rows and columns are 0-based and empty cells read as "", like with xlrd.
+
+import os.path
+
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def open_workbook(sar_file):
+    if sar_file.lower().endswith(XLSX_EXTENSIONS):
+        return XlsxWorkbook(sar_file)
+    import xlrd     # imported on first use, the commands served by the daemon do not need it
+    return xlrd.open_workbook(sar_file, on_demand=True)   # sheets are only loaded when first used
+
+
+def xlsx_value(value):
+    # cell value as xlrd returns it: numbers as floats, booleans as 0/1 and empty cells as ""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return float(value)
+    return value
+
+
+class XlsxSheet:
+    # Rows are streamed from the sheet XML on demand and kept once read, so a sheet is only parsed up to the last
+    # row that was asked for, once.
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.rows_iter = None
+        self.rows = []          # values of the rows read so far
+        self.max_row = worksheet.max_row     # from the sheet dimension, None when the file does not have one
+
+    def read_rows(self, end_rowx):
+        if self.rows_iter is None:
+            self.rows_iter = self.worksheet.iter_rows(values_only=True)
+        while len(self.rows) < end_rowx:
+            row = next(self.rows_iter, None)
+            if row is None:
+                self.max_row = len(self.rows)
+                break
+            self.rows.append(row)
+
+    @property
+    def nrows(self):
+        if self.max_row is None:
+            self.read_rows(float("inf"))
+        return self.max_row
+
+    def row(self, rowx):
+        self.read_rows(rowx + 1)
+        return self.rows[rowx] if rowx < len(self.rows) else ()
+
+    def cell_value(self, rowx, colx):
+        row = self.row(rowx)
+        return xlsx_value(row[colx] if colx < len(row) else None)
+
+    def row_values(self, rowx, start_colx=0, end_colx=None):
+        row = self.row(rowx)
+        if end_colx is None:
+            end_colx = len(row)
+        return [xlsx_value(row[colx] if colx < len(row) else None) for colx in range(start_colx, end_colx)]
+
+    def col_values(self, colx, start_rowx=0, end_rowx=None):
+        if end_rowx is None:
+            end_rowx = self.nrows
+        return [self.cell_value(rowx, colx) for rowx in range(start_rowx, end_rowx)]
+
+
+class XlsxWorkbook:
+    def __init__(self, sar_file):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportError("openpyxl is needed to read " + os.path.basename(sar_file))
+        # read-only mode streams the sheets instead of loading them, data_only reads the cached formula results
+        self.book = openpyxl.load_workbook(sar_file, read_only=True, data_only=True)
+        self.sheets = {}
+
+    def sheet_by_name(self, name):
+        if name not in self.sheets:
+            self.sheets[name] = XlsxSheet(self.book[name])
+        return self.sheets[name]
+
+    def unload_sheet(self, name):
+        self.sheets.pop(name, None)
+
+    def release_resources(self):
+        self.sheets = {}
+        self.book.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import collections
+import hashlib
+import json
+import os
+import os.path
+
+import sarrecords
+
+PARSER_VERSION = 1      # bump whenever the data extracted from the SAR file changes, to invalidate old entries
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024   # bytes
+
+
+def default_cache_size():
+    if os.environ.get("SAR_CACHE_SIZE"):     # in MB
+        return int(os.environ["SAR_CACHE_SIZE"]) * 1024 * 1024
+    return DEFAULT_CACHE_SIZE
+
+
+def default_cache_dir():
+    if os.environ.get("SAR_CACHE_DIR"):
+        return os.environ["SAR_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sarcli")
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SARCache:
+    # Parsed SAR data stored on disk as one JSON file per SAR, keyed by the SAR file content hash.
+    # Least recently used entries are evicted once the cache grows over max_size bytes.
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size or default_cache_size()
+        self.size = None    # estimated size of the cache, so that it is not scanned after each put
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, sar_hash):
+        return os.path.join(self.cache_dir, "sar-{0}-v{1}.json".format(sar_hash, PARSER_VERSION))
+
+    def get(self, sar_hash):
+        path = self.entry_path(sar_hash)
+        try:
+            with open(path) as f:
+                entry = json.load(f, object_pairs_hook=collections.OrderedDict)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)     # mark as recently used
+        except OSError:
+            pass    # read-only or shared cache directory: still a hit
+        self.hits += 1
+        return entry
+
+    def put(self, sar_hash, entry):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            import tempfile    # only needed on a cache miss
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f, default=sarrecords.to_json)
+                size = f.tell()
+            os.replace(tmp_path, self.entry_path(sar_hash))   # atomic, concurrent readers never see a partial entry
+        except OSError:
+            return      # the cache is best effort, never fail a run because of it
+        if self.size is None:
+            self.size = self.evict()
+        else:
+            self.size += size
+            if self.size > self.max_size:
+                self.size = self.evict()
+
+    def evict(self):
+        # removes the least recently used entries down to 90% of max_size, so that the next scan of the cache
+        # directory is not needed before many more puts, returns the size left
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not (name.startswith("sar-") and name.endswith(".json")):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        if total <= self.max_size:
+            return total
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
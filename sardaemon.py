@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# "sar serve" daemon: keeps the parts catalogs, BOM rules and recently parsed SARs in memory and runs the
+# config/bom/diff commands sent by sar.py over a unix socket.
+# Protocol: one JSON request per connection, on one line, e.g.
+#   {"command": "bom", "sarfile": "/abs/path.xls", "partsfile": "/abs/parts.json", "rulesfile": "/abs/rules.json",
+#    "format": "text", "near": false}
+# answered by one JSON line, {"output": "text printed by the command"} or {"error": "message"}.
+# socket and socketserver are imported on first use: sar.py imports this module on every run, and only needs a
+# socket when a daemon is listening.
+
+import collections
+import json
+import os
+import os.path
+import sys
+
+import sarcache
+import sarrules
+
+DEFAULT_SOCKET_NAME = "sar.sock"
+MEMORY_CACHE_ENTRIES = 32      # parsed SARs kept in memory
+CONNECT_TIMEOUT = 0.5          # seconds, before falling back to in-process execution
+REQUEST_TIMEOUT = 120          # seconds
+
+
+def default_socket_path():
+    return os.environ.get("SAR_SOCKET") or os.path.join(sarcache.default_cache_dir(), DEFAULT_SOCKET_NAME)
+
+
+def available():
+    import socket
+    return hasattr(socket, "AF_UNIX")    # no unix sockets on Windows (before Python 3.9/Windows 10 builds)
+
+
+class MemoryCache:
+    # in-memory LRU of parsed SARs in front of the disk cache, same interface as sarcache.SARCache
+    def __init__(self, disk_cache=None, max_entries=MEMORY_CACHE_ENTRIES):
+        self.disk_cache = disk_cache
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()     # content hash -> parsed data
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sar_hash):
+        entry = self.entries.get(sar_hash)
+        if entry is not None:
+            self.entries.move_to_end(sar_hash)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = self.disk_cache.get(sar_hash) if self.disk_cache is not None else None
+        if entry is not None:
+            self.store(sar_hash, entry)
+        return entry
+
+    def put(self, sar_hash, entry):
+        self.store(sar_hash, entry)
+        if self.disk_cache is not None:
+            self.disk_cache.put(sar_hash, entry)
+
+    def store(self, sar_hash, entry):
+        self.entries[sar_hash] = entry
+        self.entries.move_to_end(sar_hash)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class SARDaemon:
+    def __init__(self, use_cache=True):
+        self.cache = MemoryCache(sarcache.SARCache() if use_cache else None)
+        self.catalogs = {}    # parts file path -> (mtime, size, catalog)
+
+    def load_parts(self, partslist_file):
+        import sar
+        st = os.stat(partslist_file)
+        if partslist_file in self.catalogs and self.catalogs[partslist_file][:2] == (st.st_mtime_ns, st.st_size):
+            return self.catalogs[partslist_file][2]
+        parts = sar.SARconfig.load_parts(partslist_file)
+        self.catalogs[partslist_file] = (st.st_mtime_ns, st.st_size, parts)
+        return parts
+
+    def process(self, request):
+        import sar
+        try:
+            parts = self.load_parts(request["partsfile"])
+            rules = sar.SARconfig.load_rules(request["rulesfile"])    # reloaded when the rules file changes
+            sarconfig = sar.SARconfig(request["sarfile"], parts=parts, cache=self.cache, rules=rules)
+            output = sar.command_output(sarconfig, request["command"], request.get("format", "text"),
+                                        request.get("near", False))
+            sarconfig.close()
+            response = {"output": output}
+            if request.get("cache_stats"):     # sar.py --cache-stats: hits and misses of the daemon's cache
+                response["cache"] = self.cache.stats()
+            return response
+        except (sar.SARError, sarrules.RuleError) as e:    # same message as the in-process command
+            return {"error": str(e)}
+        except Exception as e:     # reported by the client, the daemon keeps running
+            import sarbatch
+            return {"error": sarbatch.error_message(e)}
+
+
+def handle_connection(sar_daemon, rfile, wfile):
+    line = rfile.readline()
+    if not line:    # connection only opened to check that the daemon is running
+        return
+    try:
+        request = json.loads(line.decode("utf-8"))
+    except ValueError as e:
+        response = {"error": "Invalid request: {0}".format(e)}
+    else:
+        response = sar_daemon.process(request)
+    wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+def daemon_running(socket_path):
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(CONNECT_TIMEOUT)
+            s.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(socket_path, partslist_file=None, rules_file=None, use_cache=True):
+    if not available():
+        sys.exit("sar serve needs unix sockets, not available on this platform")
+    if os.path.exists(socket_path):
+        if daemon_running(socket_path):
+            sys.exit("A daemon is already listening on " + socket_path)
+        os.unlink(socket_path)     # left over by a daemon that did not exit cleanly
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    import signal
+    import socketserver
+    import sar     # imported before the first request so that it is served warm
+
+    class SARRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            handle_connection(self.server.sar_daemon, self.rfile, self.wfile)
+
+    sar_daemon = SARDaemon(use_cache)
+    if partslist_file:
+        sar_daemon.load_parts(os.path.abspath(partslist_file))
+        sar.SARconfig.load_rules(os.path.abspath(rules_file or sar.default_rules_file(partslist_file)))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    old_umask = os.umask(0o077)    # the socket is only usable by the user running the daemon
+    try:
+        server = socketserver.UnixStreamServer(socket_path, SARRequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.sar_daemon = sar_daemon
+    print("sar daemon listening on " + socket_path, file=sys.stderr)
+    try:
+        server.serve_forever()     # one request at a time, the caches are not shared between threads
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def request(socket_path, sar_request):
+    # returns the daemon response, or None if no daemon is listening on socket_path
+    if not os.path.exists(socket_path) or not available():
+        return None
+    import socket
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(CONNECT_TIMEOUT)
+        try:
+            s.connect(socket_path)
+        except OSError:
+            return None
+        s.settimeout(REQUEST_TIMEOUT)
+        try:
+            s.sendall((json.dumps(sar_request) + "\n").encode("utf-8"))
+            with s.makefile("rb") as f:
+                line = f.readline()
+        except OSError:     # daemon stopped or stuck, run the command in-process instead
+            return None
+    finally:
+        s.close()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
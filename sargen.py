@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Synthetic SAR workbooks for tests and benchmarks. The racks are random but consistent with what
+# load_rack_info expects, and the Order Information sheet holds the BOM generated for each rack.
+
+import argparse
+import collections
+import os
+import os.path
+import random
+import sys
+
+import sar
+
+SAR_RELEASE = 20180516
+MAX_RACKS = 11      # get_rack_count reads 11 rows of the Cloud Subscriptions sheet
+
+COUNTRIES = ("France", "Germany", "United Kingdom", "United States", "Japan", "Brazil", "India", "Australia")
+PDU_TYPES = (
+    "* Single-Phase 2(Two)x22kVA High Voltage Power Supplies (EMEA & APAC (excluding Japan /Taiwan)",
+    "* Single-Phase 2(Two)x15kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)",
+    "* Three-Phase 2(Two)x15kVA High Voltage Power Supplies  (EMEA & APAC (excluding Japan /Taiwan)",
+    "* Three-Phase 2(Two)x24kVA High Voltage Power Supplies  (EMEA & APAC (excluding Japan /Taiwan)",
+    "* Three-Phase 2(Two)x15kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)",
+    "* Three-Phase 2(Two)x24kVA Low Voltage Power Supplies (Americas / Japan /Taiwan)",
+)
+OCC_TYPES = ("OCC CP", "OCC")
+EXACC_TYPES = ("ExaCC Full", "ExaCC Half", "ExaCC Quarter", "ExaCC Base")    # in Cloud Subscriptions column order
+BDCC_TYPES = ("BDCC Full", "BDCC Starter")
+DISTANCES = ("5m", "10m", "20m", "50m")
+UPSTREAM_LENGTHS = ("10m", "20m", "50m")
+
+
+def random_config(rng, rackcount=None):
+    # returns a config dictionary shaped like SARconfig.config
+    rackcount = rackcount or rng.randint(1, MAX_RACKS)
+    config = {}
+    country = rng.choice(COUNTRIES)
+    config["customer"] = {"name": "Customer {0}".format(rng.randint(1, 99999)), "country": country,
+                          "indirect": rng.random() < 0.3}
+    config["subscriptions"] = collections.OrderedDict((name, rng.randint(0, 20)) for name, key in sar.SUBSCRIPTIONS)
+    config["hw"] = collections.OrderedDict()
+    config["network"] = {}
+    config["sar release"] = SAR_RELEASE
+    spine = rackcount > 1 and rng.random() < 0.5
+    distances = [rng.choice(DISTANCES) for rackid in range(rackcount + 1)]
+    for rackid in range(rackcount):
+        rack = {}
+        rack["id"] = rackid + 1
+        if rackid == 0:
+            racktype = rng.choice(OCC_TYPES + EXACC_TYPES)
+        else:
+            racktype = rng.choice(OCC_TYPES + EXACC_TYPES + BDCC_TYPES)
+        rack["type"] = racktype
+        if racktype in OCC_TYPES:
+            if racktype == "OCC CP":
+                rack["CP qty"] = 1
+            rack["block hdd qty"] = rng.randint(0, 6)
+            rack["object qty"] = rng.randint(0, 4)
+            rack["oasg qty"] = rng.randint(0, 2)
+            rack["block ssd qty"] = rng.randint(0, 4)
+            rack["compute qty"] = rng.randint(0, 16)
+        elif racktype in BDCC_TYPES:
+            rack["node qty"] = rng.randint(3, 18)
+        # rack1 and OCC racks always have ToR switches, other ExaCC racks may connect to an earlier rack instead
+        if rackid == 0 or racktype in OCC_TYPES:
+            rack["ToR deployed"] = True
+        elif racktype in EXACC_TYPES:
+            rack["ToR deployed"] = rng.random() < 0.5
+        else:
+            rack["ToR deployed"] = False
+        rack["spine deployed"] = spine if rackid == 0 else False
+        rack["pdu type"] = rng.choice(PDU_TYPES)
+        rack["internal connection"] = {}
+        if rack["ToR deployed"] or racktype in BDCC_TYPES:
+            rack["upstream cable type"] = rng.choice(("MPO_MPO", "MPO_4LC"))
+            rack["upstream cable length"] = rng.choice(UPSTREAM_LENGTHS)
+            rack["upstream cable count"] = rng.choice((0, 2, 4, 8))
+            if spine:
+                rack["internal connection"]["type"] = "ToR to spine"
+                if rackid == 0:
+                    rack["internal connection"]["distance"] = distances[1]  # distance for Rack2 instead
+                else:
+                    rack["internal connection"]["distance"] = distances[rackid]
+                    rack["internal connection"]["distance to OOB"] = distances[rackid]
+            elif rackid > 0:
+                rack["internal connection"]["type"] = "ToR to ToR"
+                rack["internal connection"]["distance"] = distances[rackid]
+                rack["internal connection"]["distance to OOB"] = distances[rackid]
+        else:
+            connectable = [name for name, r in config["hw"].items() if r["type"] in OCC_TYPES + EXACC_TYPES]
+            rack["internal connection"]["type"] = "eth to ToR"
+            rack["internal connection"]["to rack"] = rng.choice(connectable)
+            rack["internal connection"]["distance"] = distances[rackid]
+            rack["internal connection"]["distance to OOB"] = distances[rackid]
+        config["hw"]["rack" + str(rackid + 1)] = rack
+    return config
+
+
+def bom_text(sarconfig, rackname):
+    # BOM of a rack as entered in the Order Information sheet
+    lines = []
+    for partnickname, qty in sarconfig.bom[rackname].items():
+        sku, label = sarconfig.parts[partnickname]
+        lines.append('{0} x {1} {2}'.format(qty, sku, label))
+    return "\n".join(lines)
+
+
+class XlsxSheetWriter:
+    # write(rowx, colx, value) of xlwt on top of an openpyxl sheet
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def write(self, rowx, colx, value):
+        self.worksheet.cell(row=rowx + 1, column=colx + 1, value=value)
+
+
+class XlsxBookWriter:
+    def __init__(self):
+        import openpyxl     # only needed to write synthetic .xlsx SAR files
+        self.book = openpyxl.Workbook()
+        self.book.remove(self.book.active)
+
+    def add_sheet(self, name):
+        return XlsxSheetWriter(self.book.create_sheet(name))
+
+    def save(self, path):
+        self.book.save(path)
+
+
+def write_sar(path, config, partslist_file="./CatC-partslist.json", parts=None, rules=None, rng=None):
+    (row, col) = sar.SAR_LAYOUT_BY_RELEASE[config["sar release"]]
+    sarconfig = sar.SARconfig(config=config, partslist_file=partslist_file, parts=parts, rules=rules)
+    if path.lower().endswith(".xlsx"):
+        wb = XlsxBookWriter()
+    else:
+        import xlwt     # only needed to write synthetic SAR files
+        wb = xlwt.Workbook()
+    sheets = {}
+    for name in (sar.SHEET_REVISION, sar.SHEET_CONTACT, sar.SHEET_CUSTOMERSITE, sar.SHEET_SUBSCRIPTIONS,
+                 sar.SHEET_HWREQUIREMENTS, sar.SHEET_ORDERINFORMATION):
+        sheets[name] = wb.add_sheet(name)
+    sheets[sar.SHEET_REVISION].write(0, 20, config["sar release"])
+    sheets[sar.SHEET_CONTACT].write(row["customer name"], col["customer"], config["customer"]["name"])
+    customer = config["customer"]
+    # countries marked with (**) ask whether the sale is indirect
+    country = customer["country"] + "(**)" if customer["indirect"] or (rng and rng.random() < 0.5) else customer["country"]
+    sheets[sar.SHEET_CUSTOMERSITE].write(row["country"], col["install location"], country)
+    sheets[sar.SHEET_CUSTOMERSITE].write(row["indirect sale"], col["install location"], "Yes" if customer["indirect"] else "No")
+    subscriptions = sheets[sar.SHEET_SUBSCRIPTIONS]
+    for name, rowx in sar.SAR_SUBSCRIPTION_ROWS[config["sar release"]].items():
+        subscriptions.write(rowx, col["subscription"], config["subscriptions"][name])
+    hwsheet = sheets[sar.SHEET_HWREQUIREMENTS]
+    racks = list(config["hw"].values())
+    for rackid in range(MAX_RACKS):
+        rowx = row["rack_deployed"] + rackid
+        rack = racks[rackid] if rackid < len(racks) else {}
+        # rack allocation columns, from the OCC ones to the BDCC node qty, relative to the first OCC one
+        allocation = [0] * (col["bdcc_rack_allocation"] + 3 - col["occ_rack_allocation"])
+        racktype = rack.get("type")
+        occ = 0
+        exacc = col["exacc_rack_allocation"] - col["occ_rack_allocation"]
+        bdcc = col["bdcc_rack_allocation"] - col["occ_rack_allocation"]
+        if racktype in OCC_TYPES:
+            allocation[occ] = 1
+            allocation[occ + 1] = rack.get("CP qty", 0)
+            allocation[occ + 2] = rack["block hdd qty"]
+            allocation[occ + 3] = rack["object qty"]
+            allocation[occ + 4] = rack["oasg qty"]
+            allocation[occ + 6] = rack["block ssd qty"]
+            allocation[occ + 7] = rack["compute qty"]
+        elif racktype in EXACC_TYPES:
+            allocation[exacc + EXACC_TYPES.index(racktype)] = 1
+        elif racktype in BDCC_TYPES:
+            allocation[bdcc + BDCC_TYPES.index(racktype)] = 1
+            allocation[bdcc + 2] = rack["node qty"]
+        for offset, value in enumerate(allocation):
+            subscriptions.write(rowx, col["occ_rack_allocation"] + offset, value)
+        subscriptions.write(rowx, col["rack_deployed"], 1 if rack else 0)
+        if not rack:
+            continue
+        subscriptions.write(rowx, col["tor_deployed"], "Y" if rack["ToR deployed"] else "N")
+        subscriptions.write(rowx, col["spine_deployed"], "Y" if rack["spine deployed"] else "N")
+        hwsheet.write(row["pdu"] + rackid, col["pdu_type"], rack["pdu type"])
+        hwsheet.write(row["pdu"] + rackid, col["pdu_whip_count"], 2)
+        if "upstream cable type" in rack:
+            hwsheet.write(row["upstream_cable"] + rackid, col["upstream_cable_type"], rack["upstream cable type"])
+            hwsheet.write(row["upstream_cable"] + rackid, col["upstream_cable_length"], rack["upstream cable length"])
+            hwsheet.write(row["upstream_cable"] + rackid, col["upstream_cable_count"], rack["upstream cable count"])
+        if "to rack" in rack["internal connection"]:
+            hwsheet.write(row["rack_connected"] + rackid, col["rack_connected"], rack["internal connection"]["to rack"])
+    for rackid, rack in enumerate(racks):
+        # rack1 has no distance of its own, with a spine its distance is read from the rack2 row
+        distance = rack["internal connection"].get("distance", "5m") if rackid > 0 else "5m"
+        hwsheet.write(row["distance"] + rackid, col["distance"], distance)
+    orderinformation = sheets[sar.SHEET_ORDERINFORMATION]
+    for rackid, rackname in enumerate(config["hw"]):
+        orderinformation.write(row["bom"] + rackid, col["bom"], bom_text(sarconfig, rackname))
+    wb.save(path)
+    return sarconfig
+
+
+def generate(directory, count, seed=0, partslist_file="./CatC-partslist.json", rackcount=None, extension=".xls"):
+    # writes count synthetic SAR files sar-00000.xls, sar-00001.xls... reusing the ones already there
+    # (sar-00000.xlsx... with extension=".xlsx", same content for the same seed)
+    os.makedirs(directory, exist_ok=True)
+    parts = sar.SARconfig.load_parts(partslist_file)
+    rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, "sar-{0:05d}{1}".format(i, extension))
+        if not os.path.isfile(path):
+            rng = random.Random("{0}-{1}".format(seed, i))
+            write_sar(path, random_config(rng, rackcount), parts=parts, rules=rules, rng=rng)
+        paths.append(path)
+    return paths
+
+
+######## MAIN #########
+def main(argv):
+    parser = argparse.ArgumentParser(prog='sargen', usage='%(prog)s directory [options]')
+    parser.add_argument("directory", type=str, help="directory where to write the SAR files")
+    parser.add_argument("-n", "--count", action="store", type=int, default=10, help="number of SAR files")
+    parser.add_argument("-s", "--seed", action="store", type=int, default=0)
+    parser.add_argument("-r", "--racks", action="store", type=int, default=None,
+                        help="number of racks per SAR (default: random, 1 to {0})".format(MAX_RACKS))
+    parser.add_argument("-p", "--partsfile", action="store", nargs='?', default="./CatC-partslist.json")
+    parser.add_argument("--xlsx", action="store_true", help="write .xlsx files (needs openpyxl) instead of .xls (needs xlwt)")
+    args = parser.parse_args(argv)
+    extension = ".xlsx" if args.xlsx else ".xls"
+    for path in generate(args.directory, args.count, args.seed, args.partsfile, args.racks, extension):
+        print(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import collections
+import hashlib
+import json
+import os
+import os.path
+import pickle
+import sys
+
+import sarcache
+
+CATALOG_VERSION = 1     # bump whenever PartsCatalog changes, to invalidate old snapshots
+
+Part = collections.namedtuple("Part", ["sku", "label"])
+
+
+class PartsCatalog:
+    # Parts list indexed by nickname (in parts list order) and by sku
+    def __init__(self, parts):
+        self.parts = collections.OrderedDict()     # nickname -> Part(sku, label)
+        self.nickname_by_sku = {}                  # sku -> nickname, the first one if several parts share a sku
+        for nickname, sku, label in parts:
+            nickname = sys.intern(nickname)
+            sku = sys.intern(sku)
+            self.parts[nickname] = Part(sku, label)
+            self.nickname_by_sku.setdefault(sku, nickname)
+
+    @classmethod
+    def from_json(cls, text):
+        parts = json.loads(text, object_pairs_hook=collections.OrderedDict)
+        return cls((nickname, info["sku"], info["label"]) for nickname, info in parts.items())
+
+    def __getitem__(self, nickname):
+        return self.parts[nickname]
+
+    def __contains__(self, nickname):
+        return nickname in self.parts
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def items(self):
+        return self.parts.items()
+
+    def to_dict(self):
+        # same shape as the parts list JSON file
+        return collections.OrderedDict((nickname, collections.OrderedDict((("sku", part.sku), ("label", part.label))))
+                                       for nickname, part in self.parts.items())
+
+
+def snapshot_path(partslist_file, cache_dir=None):
+    name = hashlib.sha1(os.path.abspath(partslist_file).encode()).hexdigest()
+    return os.path.join(cache_dir or sarcache.default_cache_dir(), "parts-{0}-v{1}.pickle".format(name, CATALOG_VERSION))
+
+
+def load_catalog(partslist_file, cache_dir=None):
+    # The compiled catalog is kept in a pickle snapshot which is reused as long as the parts list file
+    # has the same mtime and size, or the same content hash if only its mtime changed.
+    st = os.stat(partslist_file)
+    path = snapshot_path(partslist_file, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception:   # missing, unreadable or stale snapshot: rebuild it
+        snapshot = None
+    if snapshot is not None and (snapshot["mtime_ns"], snapshot["size"]) == (st.st_mtime_ns, st.st_size):
+        return snapshot["catalog"]
+    with open(partslist_file, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if snapshot is not None and snapshot["sha256"] == sha256:
+        catalog = snapshot["catalog"]
+    else:
+        catalog = PartsCatalog.from_json(data.decode("utf-8"))
+    save_snapshot(path, {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": sha256, "catalog": catalog})
+    return catalog
+
+
+def save_snapshot(path, snapshot):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        import tempfile    # only needed when the snapshot is rebuilt
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass    # the snapshot is only an optimization
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Compact records for the parsed SAR data. A SAR batch keeps thousands of racks in memory, and a dict per rack
+# (plus one per internal connection) costs several times the memory of an object with __slots__.
+# RackConfig, InternalConnection and CustomerInfo still behave like the dicts they replace: rack["compute qty"],
+# "to rack" in connection, rack.get(...), rack.items()..., with the keys in the same order, so the BOM rules and
+# the JSON output (see to_json) are unchanged. A field that was never set is a missing key.
+
+import collections
+
+
+class Record:
+    __slots__ = ()
+    FIELDS = ()         # (key, attribute) pairs, in the order of the keys in the JSON output
+    ATTRIBUTES = {}     # key -> attribute, built from FIELDS
+
+    def __init__(self, items=()):
+        for key, value in (items.items() if hasattr(items, "items") else items):
+            self[key] = value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self.ATTRIBUTES[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.ATTRIBUTES:
+            raise KeyError(key)
+        setattr(self, self.ATTRIBUTES[key], value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self.ATTRIBUTES[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.ATTRIBUTES and hasattr(self, self.ATTRIBUTES[key])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key, attribute in self.FIELDS if hasattr(self, attribute)]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __getstate__(self):     # pickled by the batch worker processes
+        return self.items()
+
+    def __setstate__(self, items):
+        for key, value in items:
+            self[key] = value
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, dict(self.items()))
+
+    def to_dict(self):
+        return collections.OrderedDict((key, to_json(value) if isinstance(value, Record) else value)
+                                       for key, value in self.items())
+
+
+def record_class(name, fields):
+    # Record subclass with one slot per JSON key, e.g. "compute qty" -> compute_qty
+    fields = tuple((key, key.replace(" ", "_").replace("-", "_")) for key in fields)
+    return type(name, (Record,), {"__slots__": tuple(attribute for key, attribute in fields), "FIELDS": fields,
+                                  "ATTRIBUTES": dict(fields)})
+
+
+CustomerInfo = record_class("CustomerInfo", ("name", "country", "indirect"))
+InternalConnection = record_class("InternalConnection", ("type", "to rack", "distance", "distance to OOB"))
+RackConfig = record_class("RackConfig", (
+    "id", "type", "CP qty", "block hdd qty", "object qty", "oasg qty", "block ssd qty", "compute qty", "node qty",
+    "ToR deployed", "spine deployed", "pdu type", "internal connection",
+    "upstream cable type", "upstream cable length", "upstream cable count"))
+
+# line of a BOM, as entered in the Order Information sheet or generated
+BomLine = collections.namedtuple("BomLine", ["qty", "sku", "label"])
+
+
+def to_json(value):
+    # default= of json.dumps for the records
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError("Object of type {0} is not JSON serializable".format(type(value).__name__))
+
+
+def rack_config(rack):
+    # RackConfig of a rack config dict (e.g. read from the cache)
+    rack = RackConfig(rack)
+    if "internal connection" in rack:
+        rack["internal connection"] = InternalConnection(rack["internal connection"])
+    return rack
+
+
+def typed_config(config):
+    # replaces the customer info and rack configs of a config read as plain dicts (e.g. from the cache) by records
+    config["customer"] = CustomerInfo(config["customer"])
+    for rackname, rack in config["hw"].items():
+        config["hw"][rackname] = rack_config(rack)
+    return config
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# "sar rollup": total demand per part over many SARs, broken down by customer country and indirect/direct sale.
+# The BOM of every rack becomes one row of a dense racks x parts matrix (a flat array of quantities, one column per
+# part of the catalog), and the totals of a group are column sums over its rows.
+
+import array
+import collections
+import csv
+import io
+import json
+import operator
+import sys
+
+import sar
+import sarbatch
+
+GROUP_BY = ("country", "indirect")
+CUSTOMER_KEYS = ("name", "country", "indirect")    # keys of config["customer"] the totals can be broken down by
+
+
+def sar_file_racks(sar_file):
+    # runs in the batch workers: customer info and sparse BOM of each rack of the SAR, or the error
+    try:
+        sarconfig = sar.SARconfig(sar_file, parts=sarbatch.worker_parts, cache=sarbatch.worker_cache,
+                                  rules=sarbatch.worker_rules)
+        sarconfig.close()
+        return sar_file, sarconfig.config["customer"], list(sarconfig.bom.values()), None
+    except Exception as e:     # a bad SAR must not stop the rollup
+        return sar_file, None, [], sarbatch.error_message(e)
+
+
+class DemandMatrix:
+    def __init__(self, parts, group_by=GROUP_BY):
+        self.parts = parts
+        self.columns = list(parts)      # part nicknames, in catalog order
+        self.column_index = {partname: colx for colx, partname in enumerate(self.columns)}
+        self.group_by = group_by
+        self.cells = array.array("l")   # racks x parts quantities, one row after the other
+        self.row_groups = []            # group of each row, e.g. ("France", False)
+        self.unknown_parts = collections.Counter()    # parts of the BOM rules missing from the catalog
+        self.group_unknown_parts = collections.defaultdict(collections.Counter)     # the same per group
+        self.files = 0
+        self.errors = collections.OrderedDict()       # SAR file -> error
+
+    @property
+    def racks(self):
+        return len(self.row_groups)
+
+    def add_sar(self, customer, rack_boms):
+        group = tuple(customer[key] for key in self.group_by)
+        for partsqty in rack_boms:
+            row = [0] * len(self.columns)
+            for partname, qty in partsqty.items():
+                colx = self.column_index.get(partname)
+                if colx is None:    # e.g. a cable built from a free-text length of the SAR
+                    self.unknown_parts[partname] += qty
+                    self.group_unknown_parts[group][partname] += qty
+                else:
+                    row[colx] = qty
+            self.cells.extend(row)
+            self.row_groups.append(group)
+        self.files += 1
+
+    def sum_rows(self, rowxs):
+        width = len(self.columns)
+        total = [0] * width
+        for rowx in rowxs:
+            total = list(map(operator.add, total, self.cells[rowx * width:(rowx + 1) * width]))
+        return total
+
+    def sum_columns(self):
+        width = len(self.columns)
+        return [sum(self.cells[colx::width]) for colx in range(width)]
+
+    def totals(self):
+        # returns (group, racks, quantity of each column, parts not in the catalog) per group, sorted by group, then
+        # the grand total
+        group_rows = collections.defaultdict(list)
+        for rowx, group in enumerate(self.row_groups):
+            group_rows[group].append(rowx)
+        totals = []
+        for group in sorted(group_rows, key=lambda group: [str(value) for value in group]):
+            totals.append((group, len(group_rows[group]), self.sum_rows(group_rows[group]),
+                           self.group_unknown_parts.get(group, collections.Counter())))
+        totals.append((("*",) * len(self.group_by), self.racks, self.sum_columns(), self.unknown_parts))
+        return totals
+
+    def dump_json(self):
+        result = collections.OrderedDict()
+        result["files"] = self.files
+        result["racks"] = self.racks
+        result["groups"] = []
+        for group, racks, qtys, unknown in self.totals():
+            entry = collections.OrderedDict(zip(self.group_by, group))
+            entry["racks"] = racks
+            entry["parts"] = collections.OrderedDict((partname, qty) for partname, qty in zip(self.columns, qtys) if qty)
+            if unknown:
+                entry["parts not in the catalog"] = collections.OrderedDict(sorted(unknown.items()))
+            result["groups"].append(entry)
+        result["errors"] = self.errors
+        return json.dumps(result, indent=4)
+
+    def dump_csv(self):
+        # one line per group and part with a demand, the "*" group is the total of all the SARs; the parts missing
+        # from the catalog come last in their group, without sku and label
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(list(self.group_by) + ["racks", "part", "sku", "label", "qty"])
+        for group, racks, qtys, unknown in self.totals():
+            for partname, qty in zip(self.columns, qtys):
+                if qty:
+                    writer.writerow(list(group) + [racks, partname, self.parts[partname].sku,
+                                                   self.parts[partname].label, qty])
+            for partname, qty in sorted(unknown.items()):
+                writer.writerow(list(group) + [racks, partname, "", "", qty])
+        return out.getvalue()
+
+
+def rollup(path, partslist_file, rules_file, jobs=None, use_cache=True, group_by=GROUP_BY):
+    sar_files = sarbatch.list_sar_files(path)
+    matrix = DemandMatrix(sar.SARconfig.load_parts(partslist_file), group_by)
+    for sar_file, customer, rack_boms, error in sarbatch.map_sar_files(sar_file_racks, sar_files, partslist_file,
+                                                                       rules_file, jobs, use_cache):
+        if error:
+            matrix.errors[sar_file] = error
+        else:
+            matrix.add_sar(customer, rack_boms)
+    for sar_file, error in matrix.errors.items():
+        print("{0}: {1}".format(sar_file, error), file=sys.stderr)
+    if matrix.unknown_parts:    # totalled without a SKU
+        print("Parts not in the catalog: " + ", ".join("{0} ({1})".format(partname, qty)
+                                                       for partname, qty in sorted(matrix.unknown_parts.items())),
+              file=sys.stderr)
+    return matrix
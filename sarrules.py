@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# BOM rules engine. The rules that turn the hardware config of a rack into parts quantities are described
+# in a JSON rules file (CatC-bomrules.json) and compiled once into Python closures.
+#
+# The rules file contains {"rules": [rule, ...]}. The rules are applied in order to each rack. A rule is:
+#   {"when": {ref: test, ...},       optional, all the tests must pass for the rule to apply
+#    "set": {part: value, ...},      part quantity = value
+#    "add": {part: value, ...},      part quantity += value
+#    "then": [rule, ...]}            sub-rules applied after set/add
+# or {"choose": [rule, ...]} which applies only the first rule whose "when" passes (if/elif/else).
+#
+# A ref (or a value) is a string starting with "$":
+#   $rack.<key>[.<key>...]       value from the rack config, e.g. "$rack.internal connection.distance"
+#   $connected.<key>[...]        value from the config of the rack named in "internal connection"/"to rack"
+#   $customer.<key>              value from the customer info, e.g. "$customer.indirect"
+#   $qty.<part>                  quantity of a part computed so far for the rack
+#   $rackname                    name of the rack ("rack1", "rack2", ...)
+# Any other value is a constant. A test is a constant (equality), a list (membership) or a dict of
+# operators {"==", "!=", ">", ">=", "<", "<=", "in", "not in"} -> constant.
+# A part name may contain refs between braces, e.g. "cable MPO_MPO {rack.internal connection.distance}".
+
+import collections
+import json
+import operator
+import os
+import re
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "in": lambda value, choices: value in choices,
+    "not in": lambda value, choices: value not in choices,
+}
+
+
+class RuleError(Exception):
+    pass
+
+
+def compile_path(getter, keys):
+    # getter(rack, rackname, config, qty) -> dict, then walk down the keys
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda rack, rackname, config, qty: getter(rack, rackname, config, qty)[key]
+
+    def get(rack, rackname, config, qty):
+        value = getter(rack, rackname, config, qty)
+        for key in keys:
+            value = value[key]
+        return value
+    return get
+
+
+def compile_ref(ref):
+    if ref == "$rackname":
+        return lambda rack, rackname, config, qty: rackname
+    scope, _, path = ref[1:].partition(".")
+    if not path:
+        raise RuleError("Invalid reference: " + ref)
+    if scope == "qty":     # part names may contain dots
+        return lambda rack, rackname, config, qty: qty[path]
+    keys = path.split(".")
+    if scope == "rack":
+        return compile_path(lambda rack, rackname, config, qty: rack, keys)
+    if scope == "customer":
+        return compile_path(lambda rack, rackname, config, qty: config["customer"], keys)
+    if scope == "connected":
+        return compile_path(lambda rack, rackname, config, qty: config["hw"][rack["internal connection"]["to rack"]], keys)
+    raise RuleError("Invalid reference: " + ref)
+
+
+def compile_value(value):
+    if isinstance(value, str) and value.startswith("$"):
+        return compile_ref(value)
+    return lambda rack, rackname, config, qty: value
+
+
+def compile_partname(template):
+    # "cable {rack.upstream cable type} {rack.upstream cable length}" -> function returning the part name
+    pieces = re.split(r"\{([^}]*)\}", template)
+    if len(pieces) == 1:
+        return lambda rack, rackname, config, qty: template
+    getters = []
+    for i, piece in enumerate(pieces):
+        if i % 2:
+            getters.append(compile_ref("$" + piece))
+        elif piece:
+            getters.append(compile_value(piece))
+    # plain concatenation, the referenced values must be strings
+    return lambda rack, rackname, config, qty: "".join([get(rack, rackname, config, qty) for get in getters])
+
+
+def compile_test(ref, test):
+    get = compile_ref(ref)
+    if isinstance(test, list):
+        try:
+            choices = frozenset(test)
+        except TypeError:
+            choices = test
+        return lambda rack, rackname, config, qty: get(rack, rackname, config, qty) in choices
+    if isinstance(test, dict) and test and all(op in OPERATORS for op in test):
+        checks = [(OPERATORS[op], expected) for op, expected in test.items()]
+        return lambda rack, rackname, config, qty: all(check(get(rack, rackname, config, qty), expected)
+                                                       for check, expected in checks)
+    return lambda rack, rackname, config, qty: get(rack, rackname, config, qty) == test
+
+
+def compile_when(when):
+    tests = [compile_test(ref, test) for ref, test in when.items()]
+    if not tests:
+        return None
+    if len(tests) == 1:
+        return tests[0]
+    return lambda rack, rackname, config, qty: all(test(rack, rackname, config, qty) for test in tests)
+
+
+def compile_rule(rule):
+    # returns (when, apply): when is None for rules that always apply
+    if not isinstance(rule, dict):
+        raise RuleError("Invalid rule: " + json.dumps(rule))
+    if "choose" in rule:
+        choices = [compile_rule(r) for r in rule["choose"]]
+
+        def apply_choose(rack, rackname, config, qty):
+            for when, apply in choices:
+                if when is None or when(rack, rackname, config, qty):
+                    apply(rack, rackname, config, qty)
+                    return
+        return compile_when(rule.get("when", {})), apply_choose
+    actions = []
+    for partname, value in rule.get("set", {}).items():
+        actions.append((False, compile_partname(partname), compile_value(value)))
+    for partname, value in rule.get("add", {}).items():
+        actions.append((True, compile_partname(partname), compile_value(value)))
+    subrules = [compile_rule(r) for r in rule.get("then", [])]
+
+    def apply(rack, rackname, config, qty):
+        for add, partname, value in actions:
+            if add:
+                qty[partname(rack, rackname, config, qty)] += value(rack, rackname, config, qty)
+            else:
+                qty[partname(rack, rackname, config, qty)] = value(rack, rackname, config, qty)
+        for when, subapply in subrules:
+            if when is None or when(rack, rackname, config, qty):
+                subapply(rack, rackname, config, qty)
+    return compile_when(rule.get("when", {})), apply
+
+
+def rule_refs(rule):
+    # yields the refs used by a rule and its sub-rules, e.g. "$rack.compute qty"
+    for ref in rule.get("when", {}):
+        yield ref
+    for action in ("set", "add"):
+        for partname, value in rule.get(action, {}).items():
+            for piece in re.findall(r"\{([^}]*)\}", partname):
+                yield "$" + piece
+            if isinstance(value, str) and value.startswith("$"):
+                yield value
+    for subrule in rule.get("then", []) + rule.get("choose", []):
+        yield from rule_refs(subrule)
+
+
+class BomRules:
+    def __init__(self, rules):
+        self.rules = [compile_rule(rule) for rule in rules]
+        self.refs = set()       # every ref used by the rules, to know what a BOM depends on
+        for rule in rules:
+            self.refs.update(rule_refs(rule))
+
+    @classmethod
+    def from_json(cls, text):
+        table = json.loads(text, object_pairs_hook=collections.OrderedDict)   # the order of the actions matters
+        return cls(table["rules"])
+
+    def evaluate(self, rack, rackname, config):
+        # returns a Counter of the parts quantities for the rack
+        qty = collections.Counter()
+        for when, apply in self.rules:
+            if when is None or when(rack, rackname, config, qty):
+                apply(rack, rackname, config, qty)
+        return qty
+
+
+compiled_rules = {}     # rules file path -> (mtime, size, BomRules), so each file is compiled once per process
+
+
+def load_rules(rules_file):
+    st = os.stat(rules_file)
+    path = os.path.abspath(rules_file)
+    if path in compiled_rules and compiled_rules[path][:2] == (st.st_mtime_ns, st.st_size):
+        return compiled_rules[path][2]
+    with open(rules_file) as f:
+        rules = BomRules.from_json(f.read())
+    compiled_rules[path] = (st.st_mtime_ns, st.st_size, rules)
+    return rules
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# "sar ingest" / "sar query": local SQLite database of the parsed SARs and their generated BOMs, so that questions
+# over many SARs ("which customers ordered SKU 7115881", "SARs of release 20180725 in France") are answered with an
+# indexed query instead of parsing every workbook again. One row per SAR (keyed by its content hash, a SAR already
+# stored is not parsed again), its subscriptions, its racks and the sparse BOM lines of each rack.
+
+import collections
+import csv
+import io
+import json
+import os
+import os.path
+import sqlite3
+import sys
+
+import sar
+import sarbatch
+import sarcache
+import sarrecords
+
+DEFAULT_DB_NAME = "sars.db"
+INGEST_CHUNK = 500      # SARs written per transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sar (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    release INTEGER,
+    customer TEXT,
+    country TEXT,
+    indirect INTEGER
+);
+CREATE TABLE IF NOT EXISTS subscription (
+    sar_id INTEGER NOT NULL REFERENCES sar(id),
+    name TEXT NOT NULL,
+    qty INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rack (
+    sar_id INTEGER NOT NULL REFERENCES sar(id),
+    rackname TEXT NOT NULL,
+    type TEXT,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bom_line (
+    sar_id INTEGER NOT NULL REFERENCES sar(id),
+    rackname TEXT NOT NULL,
+    part TEXT NOT NULL,
+    sku TEXT,
+    label TEXT,
+    qty INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sar_customer ON sar(customer);
+CREATE INDEX IF NOT EXISTS sar_country ON sar(country);
+CREATE INDEX IF NOT EXISTS sar_release ON sar(release);
+CREATE INDEX IF NOT EXISTS subscription_sar ON subscription(sar_id);
+CREATE INDEX IF NOT EXISTS rack_sar ON rack(sar_id);
+CREATE INDEX IF NOT EXISTS bom_line_sku ON bom_line(sku, sar_id);
+CREATE INDEX IF NOT EXISTS bom_line_sar ON bom_line(sar_id);
+"""
+
+QUERY_COLUMNS = ("sarfile", "customer", "country", "indirect", "release")
+
+
+class StoreError(Exception):
+    pass
+
+
+def default_db_path():
+    return os.environ.get("SAR_DB") or os.path.join(sarcache.default_cache_dir(), DEFAULT_DB_NAME)
+
+
+def connect(db_path):
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    db = sqlite3.connect(db_path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def sar_file_rows(sar_file):
+    # runs in the batch workers: (sar file, sar row, subscription rows, rack rows, BOM line rows, error)
+    try:
+        sarconfig = sar.SARconfig(sar_file, parts=sarbatch.worker_parts, cache=sarbatch.worker_cache,
+                                  rules=sarbatch.worker_rules)
+        sarconfig.close()
+    except Exception as e:     # a bad SAR must not stop the ingest
+        return sar_file, None, [], [], [], sarbatch.error_message(e)
+    config = sarconfig.config
+    customer = config["customer"]
+    sar_row = (config["sar release"], customer["name"], customer["country"], int(customer["indirect"]))
+    subscriptions = list(config["subscriptions"].items())
+    racks = [(rackname, rack.get("type"), json.dumps(rack, default=sarrecords.to_json))
+             for rackname, rack in config["hw"].items()]
+    bom_lines = []
+    for rackname, partsqty in sarconfig.bom.items():
+        for partname, qty in partsqty.items():
+            sku, label = sarconfig.parts[partname] if partname in sarconfig.parts else (None, None)
+            bom_lines.append((rackname, partname, sku, label, qty))
+    return sar_file, sar_row, subscriptions, racks, bom_lines, None
+
+
+def store_sar(db, sar_hash, sar_file, sar_row, subscriptions, racks, bom_lines):
+    sar_id = db.execute("INSERT INTO sar (hash, path, release, customer, country, indirect) VALUES (?, ?, ?, ?, ?, ?)",
+                        (sar_hash, os.path.abspath(sar_file)) + sar_row).lastrowid
+    db.executemany("INSERT INTO subscription (sar_id, name, qty) VALUES (?, ?, ?)",
+                   [(sar_id,) + row for row in subscriptions])
+    db.executemany("INSERT INTO rack (sar_id, rackname, type, config) VALUES (?, ?, ?, ?)",
+                   [(sar_id,) + row for row in racks])
+    db.executemany("INSERT INTO bom_line (sar_id, rackname, part, sku, label, qty) VALUES (?, ?, ?, ?, ?, ?)",
+                   [(sar_id,) + row for row in bom_lines])
+
+
+def ingest(path, db_path, partslist_file, rules_file, jobs=None, use_cache=True, log=sys.stderr):
+    # parses and stores the SARs of path (file, directory or glob) that are not in the database yet,
+    # returns (SARs stored, SARs skipped, errors)
+    db = connect(db_path)
+    stored_hashes = {row[0] for row in db.execute("SELECT hash FROM sar")}
+    hashes = collections.OrderedDict()      # SAR file -> content hash, for the SARs to parse
+    skipped = 0
+    for sar_file in sarbatch.list_sar_files(path):
+        sar_hash = sarcache.file_hash(sar_file)
+        if sar_hash in stored_hashes:
+            skipped += 1
+        else:
+            stored_hashes.add(sar_hash)     # the same content under another name is only stored once
+            hashes[sar_file] = sar_hash
+    stored = errors = pending = 0
+    try:
+        for sar_file, sar_row, subscriptions, racks, bom_lines, error in sarbatch.map_sar_files(
+                sar_file_rows, list(hashes), partslist_file, rules_file, jobs, use_cache):
+            if error:
+                print("{0}: {1}".format(sar_file, error), file=log)
+                errors += 1
+                continue
+            store_sar(db, hashes[sar_file], sar_file, sar_row, subscriptions, racks, bom_lines)
+            stored += 1
+            pending += 1
+            if pending == INGEST_CHUNK:
+                db.commit()
+                pending = 0
+        db.commit()
+        db.execute("PRAGMA optimize")      # statistics for the query planner
+    finally:
+        db.close()
+    return stored, skipped, errors
+
+
+def query(db_path, sku=None, customer=None, country=None, release=None):
+    # SARs matching all the given criteria, in path order, as (sarfile, customer, country, indirect, release) rows,
+    # plus the total quantity of the sku in the SAR when a sku is given
+    if not os.path.isfile(db_path):
+        raise StoreError("No SAR database, run 'ingest' first: " + db_path)
+    conditions = []
+    values = []
+    for column, value in (("sar.customer", customer), ("sar.country", country), ("sar.release", release)):
+        if value is not None:
+            conditions.append(column + " = ?")
+            values.append(value)
+    columns = "sar.path, sar.customer, sar.country, sar.indirect, sar.release"
+    if sku is not None:
+        sql = "SELECT {0}, SUM(bom_line.qty) FROM bom_line JOIN sar ON sar.id = bom_line.sar_id WHERE {1} " \
+              "GROUP BY sar.id ORDER BY sar.path".format(columns, " AND ".join(["bom_line.sku = ?"] + conditions))
+        values.insert(0, sku)
+    else:
+        sql = "SELECT {0} FROM sar {1} ORDER BY sar.path".format(
+            columns, "WHERE " + " AND ".join(conditions) if conditions else "")
+    db = sqlite3.connect(db_path)
+    try:
+        return [row[:3] + (bool(row[3]),) + row[4:] for row in db.execute(sql, values)]
+    finally:
+        db.close()
+
+
+def dump_csv(rows, sku=None):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(QUERY_COLUMNS + (("qty",) if sku is not None else ()))
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def dump_json(rows, sku=None):
+    columns = QUERY_COLUMNS + (("qty",) if sku is not None else ())
+    return json.dumps([collections.OrderedDict(zip(columns, row)) for row in rows], indent=4)
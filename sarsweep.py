@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# What-if sweep: BOM of one rack of a SAR for every combination of a set of rack parameters, e.g.
+#   {"compute qty": [4, 8, 12, 16], "pdu type": ["...", "..."], "internal connection.distance": ["5m", "10m"]}
+# The config is only read once; each variant is a copy of the rack with the parameters changed, evaluated with the
+# compiled BOM rules. Racks connected to the varied rack ("to rack") are evaluated again too, since the rules look
+# at the rack they are connected to. Each variant comes with its difference to the BOM of the SAR as is.
+
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+import sar
+import sarbatch
+
+MAX_VARIANTS = 1000000
+SWEEP_CHUNK = 2000     # variants evaluated at once by a worker process
+
+
+class SweepError(Exception):
+    pass
+
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def parse_values(text):
+    # "4,8,12", "0..16" or "0..16:4" (inclusive ranges), "a|b" for values containing commas
+    if ".." in text:
+        bounds, step = (text.split(":", 1) + ["1"])[:2]
+        first, last = bounds.split("..", 1)
+        return list(range(int(first), int(last) + 1, int(step)))
+    return [parse_value(value.strip()) for value in text.split("|" if "|" in text else ",")]
+
+
+def parse_param(text):
+    # "compute qty=4,8,12" -> ("compute qty", [4, 8, 12])
+    if "=" not in text:
+        raise SweepError("Parameter must be name=values: " + text)
+    name, values = text.split("=", 1)
+    return name.strip(), parse_values(values)
+
+
+def expand_grid(params):
+    # yields one OrderedDict of parameter values per combination, the last parameter varying fastest
+    names = list(params)
+    for values in itertools.product(*(params[name] for name in names)):
+        yield collections.OrderedDict(zip(names, values))
+
+
+def grid_size(params):
+    size = 1
+    for values in params.values():
+        size *= len(values)
+    return size
+
+
+def paths_overlap(name, path):
+    # "internal connection" and "internal connection.distance" overlap, "compute qty" and "type" do not
+    return name == path or name.startswith(path + ".") or path.startswith(name + ".")
+
+
+def set_param(rack, name, value):
+    # "internal connection.distance" sets rack["internal connection"]["distance"], the nested dictionaries being
+    # copied so that the base rack is left untouched
+    keys = name.split(".")
+    for key in keys[:-1]:
+        rack[key] = dict(rack.get(key, {}))
+        rack = rack[key]
+    rack[keys[-1]] = value
+
+
+class RackSweep:
+    def __init__(self, sarconfig, rackname):
+        if rackname not in sarconfig.config["hw"]:
+            raise SweepError("No such rack: {0} (racks: {1})".format(rackname, ", ".join(sarconfig.config["hw"])))
+        self.sarconfig = sarconfig
+        self.rackname = rackname
+        # plain dictionaries, copied for each variant much faster than the sarrecords records
+        self.rack = {key: dict(value) if key == "internal connection" else value
+                     for key, value in sarconfig.config["hw"][rackname].items()}
+        # racks whose BOM depends on the varied rack
+        self.dependents = [name for name, rack in sarconfig.config["hw"].items()
+                           if name != rackname and rack.get("internal connection", {}).get("to rack") == rackname]
+        self.base = collections.OrderedDict((name, sarconfig.bom[name]) for name in [rackname] + self.dependents)
+
+    def dependents_vary(self, params):
+        # whether the BOM of the dependents can change: the rules only look at some keys of the connected rack
+        connected = [ref[len("$connected."):] for ref in self.sarconfig.rules.refs if ref.startswith("$connected.")]
+        return any(paths_overlap(name, path) for name in params for path in connected)
+
+    def evaluate(self, values, dependents=True):
+        # BOM of the varied rack and of its dependents for these parameter values (the BOM of the SAR as is for
+        # the dependents with dependents=False)
+        rack = dict(self.rack)
+        for name, value in values.items():
+            set_param(rack, name, value)
+        config = self.sarconfig.config
+        if not dependents:
+            bom = collections.OrderedDict(self.base)
+            bom[self.rackname] = self.sarconfig.sort_rack_partsqty(self.sarconfig.rules.evaluate(rack, self.rackname,
+                                                                                                 config))
+            return bom
+        if self.dependents:    # the dependents look the varied rack up in config["hw"]
+            config = dict(config)
+            config["hw"] = collections.OrderedDict(config["hw"])
+            config["hw"][self.rackname] = rack
+        evaluate = self.sarconfig.rules.evaluate
+        sort = self.sarconfig.sort_rack_partsqty
+        bom = collections.OrderedDict()
+        bom[self.rackname] = sort(evaluate(rack, self.rackname, config))
+        for name in self.dependents:
+            bom[name] = sort(evaluate(config["hw"][name], name, config))
+        return bom
+
+    def diff(self, bom):
+        # quantity changes from the BOM of the SAR as is, per rack, in parts list order
+        position = self.sarconfig.parts_position
+        unknown = len(position)
+        diff = collections.OrderedDict()
+        for name, partsqty in bom.items():
+            base = self.base[name]
+            delta = [(partname, qty - base.get(partname, 0)) for partname, qty in partsqty.items()
+                     if qty != base.get(partname, 0)]
+            delta.extend((partname, -qty) for partname, qty in base.items() if partname not in partsqty)
+            diff[name] = collections.OrderedDict(sorted(delta, key=lambda item: position.get(item[0], unknown)))
+        return diff
+
+    def results(self, params, start=0, end=None):
+        # yields one result dictionary per variant, for the variants start to end of the grid
+        dependents = self.dependents_vary(params)
+        for variant, values in enumerate(itertools.islice(expand_grid(params), start, end), start):
+            result = collections.OrderedDict()
+            result["variant"] = variant
+            result["params"] = values
+            try:
+                bom = self.evaluate(values, dependents)
+            except Exception as e:     # e.g. a parameter the rules need removed, the other variants are still valid
+                result["error"] = sarbatch.error_message(e)
+            else:
+                result["bom"] = bom
+                result["diff"] = self.diff(bom)
+            yield result
+
+
+def check_grid(params, max_variants=MAX_VARIANTS):
+    size = grid_size(params)
+    if size > max_variants:
+        raise SweepError("{0} variants, more than the {1} allowed".format(size, max_variants))
+    return size
+
+
+def sweep(sarconfig, rackname, params, max_variants=MAX_VARIANTS):
+    # yields one result dictionary per variant, in grid order
+    check_grid(params, max_variants)
+    return RackSweep(sarconfig, rackname).results(params)
+
+
+def sweep_result(config, rackname, params, max_variants=MAX_VARIANTS):
+    # runs in the sarbatch workers of the HTTP service: all the variants, or the error
+    result = collections.OrderedDict()
+    try:
+        sarconfig = sar.SARconfig(config=config, parts=sarbatch.worker_parts, rules=sarbatch.worker_rules)
+        result["variants"] = list(sweep(sarconfig, rackname, params, max_variants))
+    except Exception as e:
+        result["error"] = sarbatch.error_message(e)
+    return result
+
+
+sweep_worker = None     # (RackSweep, parameters) of the sweep run by a worker process
+
+
+def init_sweep_worker(config, rackname, params, partslist_file, rules_file):
+    global sweep_worker
+    sarconfig = sar.SARconfig(config=config, partslist_file=partslist_file, rules_file=rules_file)
+    sweep_worker = (RackSweep(sarconfig, rackname), params)
+
+
+def sweep_chunk(bounds):
+    rack_sweep, params = sweep_worker
+    return [json.dumps(result) for result in rack_sweep.results(params, *bounds)]
+
+
+def sweep_lines(sarconfig, rackname, params, partslist_file=None, rules_file=None, jobs=None):
+    # yields one JSON line per variant, in grid order; with jobs > 1 the grid is split in chunks evaluated by worker
+    # processes, which compile the parts list and rules themselves
+    size = check_grid(params)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or size < SWEEP_CHUNK * 2:
+        for result in sweep(sarconfig, rackname, params):
+            yield json.dumps(result)
+        return
+    RackSweep(sarconfig, rackname)     # reports a bad rack name before starting the workers
+    chunks = [(start, min(start + SWEEP_CHUNK, size)) for start in range(0, size, SWEEP_CHUNK)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_sweep_worker,
+                                                initargs=(sarconfig.config, rackname, params, partslist_file,
+                                                          rules_file)) as executor:
+        for lines in executor.map(sweep_chunk, chunks):
+            for line in lines:
+                yield line
+
+
+def run_sweep(sarconfig, rackname, params, partslist_file=None, rules_file=None, jobs=None, out=sys.stdout,
+              stats=False):
+    # writes one JSON line per variant
+    start = time.perf_counter()
+    count = 0
+    for line in sweep_lines(sarconfig, rackname, params, partslist_file, rules_file, jobs):
+        out.write(line + "\n")
+        count += 1
+    if stats:
+        elapsed = time.perf_counter() - start
+        print("sweep: " + json.dumps({"variants": count, "seconds": elapsed,
+                                      "variants/s": count / elapsed if elapsed else None}), file=sys.stderr)
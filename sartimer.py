@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import time
+
+try:
+    import resource     # not available on Windows
+except ImportError:
+    resource = None
+
+tracemalloc = None      # imported by the first StageTimer measuring memory, the plain CLI path does not need it
+
+
+class StageTimer:
+    # Wall time, CPU time and peak Python memory allocated in each stage of the processing of a SAR:
+    #     timer = StageTimer()
+    #     with timer.stage("build_bom"):
+    #         ...
+    # Stages can be nested and a stage entered several times is accumulated.
+    def __init__(self, memory=True):
+        self.memory = memory
+        if memory:
+            global tracemalloc
+            import tracemalloc
+        self.stages = collections.OrderedDict()
+        self.peaks = []     # peak memory of the enclosing stages being measured
+        self.tracing = False    # whether this timer started tracemalloc, and has to stop it
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.peaks.append(0)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = 0
+            if self.memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            stage = self.stages.setdefault(name, {"calls": 0, "wall ms": 0.0, "cpu ms": 0.0, "peak KB": 0})
+            stage["calls"] += 1
+            stage["wall ms"] += wall * 1000
+            stage["cpu ms"] += cpu * 1000
+            stage["peak KB"] = max(stage["peak KB"], peak // 1024)
+
+    def close(self):
+        # stops tracemalloc if this timer started it: left on, it slows down everything a worker process runs next
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def report(self):
+        self.close()
+        report = collections.OrderedDict()
+        report["stages"] = self.stages
+        if resource is not None:
+            report["max rss KB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # whole process
+        return report
+
+
+class NullTimer:
+    # timer used when no timings are requested
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# "sar watch": polls a directory of SAR files and rewrites the outputs of the ones that changed, next to them.
+# A SAR is parsed again only when its mtime or size changed and its content hash is different, and only the racks
+# whose BOM inputs changed (see SARconfig.rack_bom_key) are rebuilt. Everything is rebuilt when the parts list or
+# the BOM rules change. What was processed is saved in .sarwatch.json in the directory, so that "sar watch --once"
+# run from cron is incremental too.
+
+import collections
+import json
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+import sar
+import sarbatch
+import sarcache
+
+OUTPUT_SUFFIXES = collections.OrderedDict((("config", ".config.json"), ("bom", ".bom.txt"), ("diff", ".diff.txt"),
+                                           ("all", ".all.json")))
+DEFAULT_INTERVAL = 2.0      # seconds between two scans of the directory
+STATE_FILE = ".sarwatch.json"     # state of the watched SARs, kept between two runs
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def output_path(sar_file, command):
+    return os.path.splitext(sar_file)[0] + OUTPUT_SUFFIXES[command]
+
+
+def write_atomic(path, text):
+    # readers of the output never see a partially written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class WatchedSAR:
+    def __init__(self):
+        self.stamp = None       # (mtime, size) when last processed
+        self.hash = None
+        self.bom_cache = {}     # rack BOMs of the last build, by rack key
+
+
+class SARWatcher:
+    def __init__(self, directory, partslist_file, rules_file, commands=("bom",), use_cache=True, near=False, log=sys.stderr):
+        self.directory = directory
+        self.partslist_file = partslist_file
+        self.rules_file = rules_file
+        self.commands = commands
+        self.near = near
+        self.log = log
+        self.cache = sarcache.SARCache() if use_cache else None
+        self.sars = {}          # SAR file path -> WatchedSAR
+        self.catalog_stamp = None   # parts list and rules files, outputs written
+        self.parts = None
+        self.rules = None
+        self.load_state()
+
+    def state_path(self):
+        return os.path.join(self.directory, STATE_FILE)
+
+    def load_state(self):
+        # state saved by the last run, if any: a missing or unreadable state file only means everything is rebuilt
+        try:
+            with open(self.state_path()) as f:
+                state = json.load(f, object_pairs_hook=collections.OrderedDict)
+            catalog = state["catalog"]
+            catalog_stamp = (tuple(catalog[0]), tuple(catalog[1]), tuple(catalog[2]), catalog[3])
+            sars = {}
+            for name, entry in state["sars"].items():
+                watched = WatchedSAR()
+                watched.stamp = tuple(entry["stamp"])
+                watched.hash = entry["hash"]
+                watched.bom_cache = entry["bom cache"]
+                sars[os.path.join(self.directory, name)] = watched
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return
+        self.catalog_stamp = catalog_stamp
+        self.sars = sars
+
+    def save_state(self):
+        state = collections.OrderedDict()
+        state["catalog"] = self.catalog_stamp
+        state["sars"] = collections.OrderedDict()
+        for sar_file, watched in sorted(self.sars.items()):
+            if watched.stamp is not None:
+                state["sars"][os.path.relpath(sar_file, self.directory)] = collections.OrderedDict(
+                    (("stamp", watched.stamp), ("hash", watched.hash), ("bom cache", watched.bom_cache)))
+        try:
+            write_atomic(self.state_path(), json.dumps(state))
+        except OSError as e:   # e.g. read-only directory: the next run rebuilds everything, the outputs are up to date
+            print("{0}: {1}".format(self.state_path(), sarbatch.error_message(e)), file=self.log)
+
+    def load_catalog(self):
+        # returns True when the parts list, the rules or the outputs to write changed since the last scan
+        stamp = (file_stamp(self.partslist_file), file_stamp(self.rules_file), tuple(self.commands), self.near)
+        if stamp == self.catalog_stamp and self.parts is not None:
+            return False
+        self.parts = sar.SARconfig.load_parts(self.partslist_file)
+        self.rules = sar.SARconfig.load_rules(self.rules_file)
+        if stamp == self.catalog_stamp:     # first scan, same catalog as the saved state
+            return False
+        self.parts = sar.SARconfig.load_parts(self.partslist_file)
+        self.rules = sar.SARconfig.load_rules(self.rules_file)
+        self.catalog_stamp = stamp
+        return True
+
+    def scan(self):
+        # processes the new and changed SARs, returns the number of SARs whose outputs were written
+        rebuild_all = self.load_catalog()
+        changed = rebuild_all
+        sar_files = sarbatch.list_sar_files(self.directory)
+        for sar_file in set(self.sars) - set(sar_files):
+            del self.sars[sar_file]     # removed from the directory
+            changed = True
+        updated = 0
+        for sar_file in sar_files:
+            watched = self.sars.setdefault(sar_file, WatchedSAR())
+            try:
+                stamp = file_stamp(sar_file)
+            except OSError:
+                continue        # removed since the directory was listed
+            # outputs deleted since they were written are written again
+            outputs_missing = watched.hash is not None and not all(
+                os.path.exists(output_path(sar_file, command)) for command in self.commands)
+            if stamp == watched.stamp and not rebuild_all and not outputs_missing:
+                continue
+            changed = True
+            try:
+                sar_hash = sarcache.file_hash(sar_file)
+                if sar_hash == watched.hash and not rebuild_all and not outputs_missing:
+                    watched.stamp = stamp   # touched but not modified
+                    continue
+                if rebuild_all:
+                    watched.bom_cache = {}
+                self.process(sar_file, watched)
+                watched.stamp = stamp
+                watched.hash = sar_hash
+                updated += 1
+            except Exception as e:     # reported once, tried again when the file changes
+                watched.stamp = stamp
+                watched.hash = None
+                print("{0}: {1}".format(sar_file, sarbatch.error_message(e)), file=self.log)
+        if changed:
+            self.save_state()
+        return updated
+
+    def process(self, sar_file, watched):
+        sarconfig = sar.SARconfig(sar_file, parts=self.parts, cache=self.cache, rules=self.rules,
+                                  bom_cache=watched.bom_cache)
+        for command in self.commands:
+            write_atomic(output_path(sar_file, command), sar.command_output(sarconfig, command, near=self.near))
+        sarconfig.close()
+        watched.bom_cache = {key: watched.bom_cache[key] for key in sarconfig.rack_bom_keys.values()}
+        print("{0}: {1} of {2} racks rebuilt".format(sar_file, sarconfig.racks_built, len(sarconfig.bom)), file=self.log)
+
+    def watch(self, interval=DEFAULT_INTERVAL):
+        try:
+            while True:
+                self.scan()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
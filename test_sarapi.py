@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# HTTP service tests with the Flask test client, on synthetic SARs written by sargen (needs flask and xlwt).
+# Run with "python -m unittest" or "python -m pytest".
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+import sar
+import sargen
+
+try:
+    import sarapi
+except ImportError:     # flask not installed
+    sarapi = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARTSLIST_FILE = os.path.join(HERE, "CatC-partslist.json")
+
+
+def setUpModule():
+    global sar_dir, spool_dir, sar_files
+    if sarapi is None:
+        raise unittest.SkipTest("flask is not installed")
+    try:
+        import xlwt     # needed by sargen
+    except ImportError:
+        raise unittest.SkipTest("xlwt is not installed")
+    sar_dir = tempfile.mkdtemp(prefix="test_sarapi")
+    sar_files = sargen.generate(sar_dir, 4, seed="api", partslist_file=PARTSLIST_FILE)
+    spool_dir = tempfile.mkdtemp(prefix="test_sarapi_spool")
+    sarapi.app.config.update(SAR_PARTSFILE=PARTSLIST_FILE, SAR_WORKERS=1, SAR_MAX_PENDING=4, SAR_USE_CACHE=False,
+                             TESTING=True)
+
+
+def tearDownModule():
+    if sarapi.executor is not None:
+        sarapi.executor.shutdown()
+        sarapi.executor = None
+    shutil.rmtree(sar_dir)
+    shutil.rmtree(spool_dir)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def free_slots():
+    slots = 0
+    while sarapi.pending.acquire(blocking=False):
+        slots += 1
+    for i in range(slots):
+        sarapi.pending.release()
+    return slots
+
+
+class SARApiTest(unittest.TestCase):
+    def setUp(self):
+        self.client = sarapi.app.test_client()
+        self.tempdir = tempfile.tempdir
+        tempfile.tempdir = spool_dir    # spool files of the uploads
+        with sarapi.jobs_lock:
+            sarapi.jobs.clear()
+            sarapi.jobs_by_key.clear()
+
+    def tearDown(self):
+        for job in list(sarapi.jobs.values()):
+            try:
+                job.future.result(timeout=60)
+            except Exception:
+                pass
+        tempfile.tempdir = self.tempdir
+
+    def expected(self, sar_file, command):
+        sarconfig = sar.SARconfig(sar_file, PARTSLIST_FILE)
+        return json.loads(sar.command_output(sarconfig, command, "json"))
+
+    def poll(self, location):
+        for i in range(600):
+            job = self.client.get(location).get_json()
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.05)
+        self.fail("job not finished: " + location)
+
+    def test_bom_sync(self):
+        resp = self.client.post("/bom", data=read(sar_files[0]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()["bom"], self.expected(sar_files[0], "bom"))
+
+    def test_raw_body_sent_as_form(self):
+        # curl --data-binary sends application/x-www-form-urlencoded
+        resp = self.client.post("/bom", data=read(sar_files[0]), content_type="application/x-www-form-urlencoded")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()["bom"], self.expected(sar_files[0], "bom"))
+
+    def test_multipart(self):
+        with open(sar_files[1], "rb") as f:
+            resp = self.client.post("/config", data={"sarfile": (f, "sar.xls")}, content_type="multipart/form-data")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("hw", resp.get_json()["config"])
+
+    def test_async_and_poll(self):
+        resp = self.client.post("/diff?async=1", data=read(sar_files[2]))
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.headers["Location"], "/jobs/" + resp.get_json()["job"])
+        job = self.poll(resp.headers["Location"])
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"]["diff"], self.expected(sar_files[2], "diff"))
+
+    def test_same_sar_same_job(self):
+        first = self.client.post("/bom?async=1", data=read(sar_files[3])).get_json()
+        second = self.client.post("/bom?async=1", data=read(sar_files[3])).get_json()
+        self.assertEqual(first["job"], second["job"])
+        other = self.client.post("/bom?async=1&near=1", data=read(sar_files[3])).get_json()
+        self.assertNotEqual(first["job"], other["job"])
+
+    def test_too_large(self):
+        max_upload = sarapi.app.config["SAR_MAX_UPLOAD"]
+        sarapi.app.config["SAR_MAX_UPLOAD"] = 1024
+        try:
+            resp = self.client.post("/bom", data=read(sar_files[0]))
+        finally:
+            sarapi.app.config["SAR_MAX_UPLOAD"] = max_upload
+        self.assertEqual(resp.status_code, 413)
+
+    def test_bad_sar(self):
+        resp = self.client.post("/bom", data=b"not a workbook")
+        self.assertEqual(resp.status_code, 422)
+        self.assertIn("error", resp.get_json())
+
+    def test_empty_upload(self):
+        self.assertEqual(self.client.post("/bom", data=b"").status_code, 400)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get("/jobs/nope").status_code, 404)
+
+    def test_busy(self):
+        sarapi.get_executor()
+        slots = 0
+        while sarapi.pending.acquire(blocking=False):    # every pending slot taken
+            slots += 1
+        try:
+            resp = self.client.post("/bom", data=read(sar_files[0]))
+        finally:
+            for i in range(slots):
+                sarapi.pending.release()
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        self.assertEqual(self.client.post("/bom", data=read(sar_files[0])).status_code, 200)   # slots given back
+
+    def test_dead_worker(self):
+        self.assertEqual(self.client.post("/bom", data=read(sar_files[0])).status_code, 200)
+        pool = sarapi.executor
+        manager = pool._executor_manager_thread
+        for process in list(pool._processes.values()):     # e.g. killed by the OOM killer
+            process.kill()
+        manager.join(60)    # the pool is found broken
+        self.assertEqual(self.client.post("/bom", data=read(sar_files[1])).status_code, 200)
+        self.assertIsNot(sarapi.executor, pool)
+
+    def test_sweep(self):
+        config = self.client.post("/config", data=read(sar_files[0])).get_json()["config"]
+        resp = self.client.post("/sweep", json={"config": config, "rack": "rack1", "params": {"compute qty": [1, 2, 3]}})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([variant["params"] for variant in resp.get_json()["variants"]],
+                         [{"compute qty": 1}, {"compute qty": 2}, {"compute qty": 3}])
+        resp = self.client.post("/sweep", json={"config": config, "params": {"compute qty": list(range(20000))}})
+        self.assertEqual(resp.status_code, 422)     # more than SAR_MAX_VARIANTS
+
+    def test_sweep_timeout_keeps_slot(self):
+        config = self.client.post("/config", data=read(sar_files[0])).get_json()["config"]
+        params = {"compute qty": list(range(17)), "block ssd qty": list(range(5)), "oasg qty": [0, 1, 2],
+                  "upstream cable count": [0, 2, 4, 8, 16, 32]}
+        timeout = sarapi.app.config["SAR_TIMEOUT"]
+        sarapi.app.config["SAR_TIMEOUT"] = 0.01
+        try:
+            resp = self.client.post("/sweep", json={"config": config, "params": params})
+        finally:
+            sarapi.app.config["SAR_TIMEOUT"] = timeout
+        self.assertEqual(resp.status_code, 504)
+        max_pending = sarapi.app.config["SAR_MAX_PENDING"]
+        self.assertEqual(free_slots(), max_pending - 1)    # the sweep still running holds its slot
+        for i in range(600):    # given back when the sweep ends
+            if free_slots() == max_pending:
+                break
+            time.sleep(0.05)
+        self.assertEqual(free_slots(), max_pending)
+
+    def test_spool_files_removed(self):
+        self.client.post("/bom", data=read(sar_files[0]))
+        self.client.post("/bom", data=read(sar_files[0]))    # same job
+        self.client.post("/bom", data=b"")
+        resp = self.client.post("/bom?async=1", data=read(sar_files[1]))
+        self.poll(resp.headers["Location"])
+        for i in range(100):    # removed by the done callback of the job, right after the result is set
+            if not os.listdir(spool_dir):
+                break
+            time.sleep(0.05)
+        self.assertEqual(os.listdir(spool_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
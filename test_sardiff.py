@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Guards the BOM diff (diff_bom_lines, render_diff), whose JSON is consumed by the order review: it must find the
+# same lines, and print the same text, as the quadratic list.remove diff it replaced.
+# Run with "python -m unittest" or "python -m pytest".
+
+import collections
+import json
+import os.path
+import random
+import unittest
+
+import sar
+import sarrecords
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARTSLIST_FILE = os.path.join(HERE, "CatC-partslist.json")
+
+LINES = [sarrecords.BomLine(qty, sku, label) for qty in (1, 2, 4) for sku, label in
+         (("7115881", "Cable A"), ("7115882", "Cable B"), ("7118457", "Exadata"), ("7600001", "PDU"))]
+
+
+def quadratic_diff(bom_fromxls, bom_generated):
+    # the diff of the original diff_bom: each XLS line removes the first identical generated line
+    bom_generated = list(bom_generated)
+    only_xls = []
+    for line in bom_fromxls:
+        if line in bom_generated:
+            bom_generated.remove(line)
+        else:
+            only_xls.append(line)
+    return only_xls, bom_generated
+
+
+def quadratic_render(rack, ignored, only_xls, only_generated):
+    # text printed by the original diff_bom for a rack
+    text = rack + ":\n"
+    for line in ignored:
+        text += "Ignored line: " + line + "\n"
+    for line in only_xls:
+        text += 'in XLS but not generated:    {0:3} x  {1:7}  {2}\n'.format(str(line[0]), line[1], line[2])
+    for line in only_generated:
+        text += 'generated but not in XLS:    {0:3} x  {1:7}  {2}\n'.format(str(line[0]), line[1], line[2])
+    return text + "\n"
+
+
+def bom_lines(diff_lines):
+    return [sarrecords.BomLine(line["qty"], line["sku"], line["label"]) for line in diff_lines]
+
+
+class DiffBomLinesTest(unittest.TestCase):
+    def test_same_as_quadratic_diff(self):
+        rnd = random.Random(0)
+        for case in range(20000):
+            bom_fromxls = [rnd.choice(LINES) for i in range(rnd.randrange(8))]
+            bom_generated = [rnd.choice(LINES) for i in range(rnd.randrange(8))]
+            ignored = ["Note {0}".format(i) for i in range(rnd.randrange(2))]
+            only_xls, only_generated = quadratic_diff(bom_fromxls, bom_generated)
+            diff = sar.diff_bom_lines(bom_fromxls, bom_generated)
+            self.assertEqual(bom_lines(diff["in XLS but not generated"]), only_xls, case)
+            self.assertEqual(bom_lines(diff["generated but not in XLS"]), only_generated, case)
+            diff["ignored lines"] = ignored
+            self.assertEqual(sar.render_diff({"rack1": diff}),
+                             quadratic_render("rack1", ignored, only_xls, only_generated), case)
+
+    def test_duplicate_lines(self):
+        a, b, c = LINES[0], LINES[1], LINES[2]
+        diff = sar.diff_bom_lines([a, a, a, b], [b, a, c, a, b])
+        self.assertEqual(bom_lines(diff["in XLS but not generated"]), [a])
+        self.assertEqual(bom_lines(diff["generated but not in XLS"]), [c, b])    # the first b was matched
+
+    def test_near_deltas(self):
+        xls = [sarrecords.BomLine(2, "7115881", "Cable A"), sarrecords.BomLine(1, "7115881", "Cable A"),
+               sarrecords.BomLine(1, "7600001", "PDU"), sarrecords.BomLine(4, "7118457", "Exadata")]
+        generated = [sarrecords.BomLine(4, "7118457", "Exadata"), sarrecords.BomLine(5, "7115881", "Cable A"),
+                     sarrecords.BomLine(2, "7115882", "Cable B")]
+        diff = sar.diff_bom_lines(xls, generated, near=True)
+        self.assertEqual(list(diff), ["quantity deltas", "in XLS but not generated", "generated but not in XLS"])
+        self.assertEqual(json.loads(json.dumps(diff["quantity deltas"])), [
+            {"sku": "7115881", "label": "Cable A", "xls qty": 3, "generated qty": 5, "delta": 2}])
+        self.assertEqual(bom_lines(diff["in XLS but not generated"]), [sarrecords.BomLine(1, "7600001", "PDU")])
+        self.assertEqual(bom_lines(diff["generated but not in XLS"]), [sarrecords.BomLine(2, "7115882", "Cable B")])
+        self.assertNotIn("quantity deltas", sar.diff_bom_lines(xls, generated))
+
+
+class DiffBomTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(HERE, "test_sarrules.json")) as f:    # a config generated by sargen
+            config = json.loads(f.readline(), object_pairs_hook=collections.OrderedDict)["config"]
+        config["hw"] = collections.OrderedDict([next(iter(config["hw"].items()))])    # its first rack only
+        self.sarconfig = sar.SARconfig(config=config, partslist_file=PARTSLIST_FILE)
+        self.rack = next(iter(config["hw"]))
+        self.generated = [sarrecords.BomLine(qty, *self.sarconfig.parts[partname])
+                          for partname, qty in self.sarconfig.bom[self.rack].items()]
+
+    def order_information(self, bom_lines, notes):
+        # BOM text of the rack as entered in the Order Information sheet
+        text = "\n".join(notes + ["{0} x {1} {2}".format(*line) for line in bom_lines])
+        self.sarconfig.order_information = [text]
+
+    def test_ignored_lines_first(self):
+        first = self.generated[0]
+        self.order_information(self.generated[1:] + [sarrecords.BomLine(first.qty + 1, first.sku, first.label)],
+                               ["Rack OCC", "see quote"])
+        for near in (False, True):
+            diff = self.sarconfig.diff_bom(near)[self.rack]
+            self.assertEqual(list(diff)[0], "ignored lines")
+            self.assertEqual(diff["ignored lines"], ["Rack OCC", "see quote"])
+        text = sar.render_diff(self.sarconfig.diff_bom(near=True))
+        self.assertEqual(text.splitlines()[:4], [
+            self.rack + ":", "Ignored line: Rack OCC", "Ignored line: see quote",
+            "quantity differs:            {0:3} -> {1:3} ({2:+d})  {3:7}  {4}".format(
+                str(first.qty + 1), str(first.qty), -1, first.sku, first.label)])
+
+    def test_no_difference(self):
+        self.order_information(list(reversed(self.generated)), [])
+        diff = self.sarconfig.diff_bom()[self.rack]
+        self.assertEqual(diff, {"ignored lines": [], "in XLS but not generated": [], "generated but not in XLS": []})
+        self.assertEqual(sar.render_diff({self.rack: diff}), self.rack + ":\n\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
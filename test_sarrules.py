@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Guards CatC-bomrules.json: the sparse BOM of every rack of the configs in test_sarrules.json (generated with
+# sargen.random_config, seeds "rules-0" to "rules-59") must stay the one the hand-written build_bom produced before
+# the rules table replaced it. Run with "python -m unittest" or "python -m pytest".
+# After an intended change of the rules, check the differences reported by the test and regenerate the file.
+
+import collections
+import json
+import os.path
+import unittest
+
+import sar
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILE = os.path.join(HERE, "test_sarrules.json")
+
+
+def load_golden():
+    with open(GOLDEN_FILE) as f:
+        return [json.loads(line, object_pairs_hook=collections.OrderedDict) for line in f if line.strip()]
+
+
+class GoldenBomTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        partslist_file = os.path.join(HERE, "CatC-partslist.json")
+        cls.parts = sar.SARconfig.load_parts(partslist_file)
+        cls.rules = sar.SARconfig.load_rules(sar.default_rules_file(partslist_file))
+        cls.golden = load_golden()
+
+    def test_golden_boms(self):
+        for entry in self.golden:
+            with self.subTest(seed=entry["seed"]):
+                sarconfig = sar.SARconfig(config=entry["config"], parts=self.parts, rules=self.rules)
+                for rackname, partsqty in entry["bom"].items():
+                    # same parts, quantities and parts list order
+                    self.assertEqual(list(sarconfig.bom[rackname].items()), list(partsqty.items()), rackname)
+                self.assertEqual(list(sarconfig.bom), list(entry["bom"]))
+
+    def test_every_rack_type_covered(self):
+        types = {rack["type"] for entry in self.golden for rack in entry["config"]["hw"].values()}
+        self.assertEqual(types, {"OCC", "OCC CP", "ExaCC Base", "ExaCC Quarter", "ExaCC Half", "ExaCC Full",
+                                 "BDCC Starter", "BDCC Full"})
+
+
+if __name__ == "__main__":
+    unittest.main()